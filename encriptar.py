@@ -1,17 +1,35 @@
 import os
 import sys
+import glob
+import time
 import uuid
-import gzip
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import BinaryIO
 from cryptography.fernet import Fernet
 from google.cloud import storage
 from google.cloud import logging
 from google.cloud import secretmanager
 from datetime import datetime
 
+from gcp.key_provider import KeyProvider, as_fernet
+from gcp.framed_format import write_frames
+from gcp.composite_upload import ParallelCompositeWriter
+from gcp.stream_compression import CompressedStream
+
 # Variables de entorno
 PROJECT_ID = os.environ.get("PROJECT_ID")
 BUCKET_ENCRIPTADOS = os.environ.get("BUCKET_ENCRIPTADOS")
 SECRET_KEY = os.environ.get("SECRET_KEY")
+ENCRYPTION_FORMAT = os.environ.get("ENCRYPTION_FORMAT", "legacy") # legacy | framed
+FRAME_SIZE = int(os.environ.get("FRAME_SIZE", 4 * 1024 * 1024))
+COMPRESSION = os.environ.get("COMPRESSION", "none") # none | gzip | zstd
+UPLOAD_MODE = os.environ.get("UPLOAD_MODE", "single") # single | composite
+PART_SIZE = int(os.environ.get("PART_SIZE", 64 * 1024 * 1024))
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 8))
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 8))
+KEY_TTL = int(os.environ.get("KEY_TTL", 3600))
+KEY_CACHE_PATH = os.environ.get("KEY_CACHE_PATH") # opcional, p.ej. ~/.cache/encriptar.key
 
 # Constantes
 START_DATETIME = datetime.now()
@@ -23,33 +41,18 @@ logging_client = logging.Client()
 storage_client = storage.Client()
 secret_client = secretmanager.SecretManagerServiceClient()
 
-# Crea el directorio temp si no existe
-def create_temp_folder() -> str:
-    temp_folder = os.path.join(os.getcwd(), "temp")
-    if not os.path.exists(temp_folder):
-        os.makedirs(temp_folder, exist_ok=True)
-    return temp_folder
-
-# Comprime un archivo usando gzip
-def compress_data(input_file: str) -> str:
-    
-    # Chequea si existe o crea el directorio temp
-    temp_folder = create_temp_folder()
-    
-    # Construimos el path del archivo comprimido
-    gzip_name = os.path.basename(input_file).split(".")[0] + ".gz"
-    gzip_path = os.path.join(temp_folder, gzip_name)
-    
-    # Comprimimos el archivo
-    with open(input_file, "rb") as finput, gzip.open(gzip_path, "wb") as foutput:
-        foutput.writelines(finput)
-    return gzip_path
+# Abre el blob para escritura, en un unico stream o en partes compuestas segun UPLOAD_MODE
+def open_blob_writer(blob: storage.Blob) -> BinaryIO:
+    if UPLOAD_MODE == "composite":
+        # Las partes quedan fuera de data/ para no disparar la desencriptacion
+        return ParallelCompositeWriter(blob, part_size=PART_SIZE, workers=UPLOAD_WORKERS, temp_prefix=f"tmp/{PROCESO_ID}")
+    return blob.open(mode="wb")
 
 # Encripta un archivo usando fernet
-def encrypt_data(input_file: str, blob: storage.Blob, key: str) -> storage.Blob:
-    f = Fernet(key)
+def encrypt_data(input_file: str, blob: storage.Blob, key: str | Fernet) -> storage.Blob:
+    f = as_fernet(key)
     with open(input_file, "rb") as finput:
-        with blob.open(mode="wb") as foutput:
+        with open_blob_writer(blob) as foutput:
             block = finput.read()
             encrypted_block = f.encrypt(block)
             foutput.write(encrypted_block)
@@ -57,6 +60,152 @@ def encrypt_data(input_file: str, blob: storage.Blob, key: str) -> storage.Blob:
     blob.reload()
     return blob
 
+# Encripta un archivo usando fernet en formato framed (gcp/framed_format.py), con memoria acotada por frame_size.
+# Si se indica compression, el archivo se comprime al vuelo antes de encriptarse.
+def encrypt_data_stream(input_file: str, blob: storage.Blob, key: str | Fernet, frame_size: int = FRAME_SIZE, compression: str = "none") -> storage.Blob:
+    f = as_fernet(key)
+    with open(input_file, "rb") as finput:
+        source = finput if compression == "none" else CompressedStream(finput, compression, frame_size, size=os.path.getsize(input_file))
+        with open_blob_writer(blob) as foutput:
+            write_frames(source, foutput, f, frame_size)
+
+    blob.reload()
+    return blob
+
+# Construye el nombre del blob encriptado a partir del archivo de entrada
+def get_blob_name(input_file: str) -> str:
+    return "data/" + START_DATE + "/" + os.path.basename(input_file).split(".")[0] + ".encrypted"
+
+# Obtiene la key de encriptacion desde secret manager
+def get_secret_key() -> str:
+    name = f"projects/{PROJECT_ID}/secrets/{SECRET_KEY}/versions/latest"
+    response_secret = secret_client.access_secret_version(name=name)
+    return response_secret.payload.data.decode("UTF-8")
+
+# Cache de la key: se obtiene de secret manager una vez por KEY_TTL
+key_provider = KeyProvider(get_secret_key, ttl=KEY_TTL, cache_path=KEY_CACHE_PATH)
+
+# Encripta el archivo en el blob y le agrega la metadata del proceso.
+# key_id debe ser el de la key que encripta (KeyProvider.get_encryption_key), no uno obtenido despues.
+def upload_encrypted(input_file: str, blob: storage.Blob, key: str | Fernet, key_id: str, job_name: str) -> storage.Blob:
+    # La compresion solo esta disponible en el formato framed
+    encryption_format = "framed" if COMPRESSION != "none" else ENCRYPTION_FORMAT
+    if encryption_format == "framed":
+        blob = encrypt_data_stream(input_file=input_file, blob=blob, key=key, compression=COMPRESSION)
+    else:
+        blob = encrypt_data(input_file=input_file, blob=blob, key=key)
+    metageneration_match_precondition = None
+    metageneration_match_precondition = blob.metageneration
+    blob.metadata = {
+        "proceso_id": PROCESO_ID,
+        "job_name": job_name,
+        "encryption_format": encryption_format,
+        "compression": COMPRESSION,
+        "key_id": key_id,
+    }
+    blob.patch(if_metageneration_match=metageneration_match_precondition)
+    return blob
+
+# Resuelve los archivos a encriptar: un directorio, un glob o un manifest (un path por linea)
+def resolve_batch_files(source: str) -> list:
+    if os.path.isdir(source):
+        files = [entry.path for entry in os.scandir(source) if entry.is_file()]
+    elif glob.has_magic(source):
+        files = [path for path in glob.glob(source, recursive=True) if os.path.isfile(path)]
+    elif os.path.isfile(source):
+        with open(source, "r") as manifest:
+            files = [line.strip() for line in manifest if line.strip() and not line.startswith("#")]
+    else:
+        raise ValueError(f"No existe el directorio, glob o manifest: {source}")
+    return sorted(files)
+
+# Agrupa los archivos por blob de destino. Los que comparten blob (p.ej. report.csv y report.txt,
+# o el mismo nombre en distintos directorios) no se pueden subir: el ultimo pisaria al resto.
+def find_duplicate_blobs(files: list) -> dict:
+    files_by_blob = {}
+    for input_file in files:
+        files_by_blob.setdefault(get_blob_name(input_file), []).append(input_file)
+    return {blob_name: blob_files for blob_name, blob_files in files_by_blob.items() if len(blob_files) > 1}
+
+# Encripta y sube un archivo del batch. No lanza excepciones, devuelve el resultado.
+def encrypt_batch_file(input_file: str, key: str | Fernet, key_id: str, job_name: str) -> dict:
+    start = time.perf_counter()
+    result = {"file": input_file, "blob": get_blob_name(input_file), "bytes": 0, "status": "ok", "error": None}
+    try:
+        result["bytes"] = os.path.getsize(input_file)
+        blob = storage_client.bucket(BUCKET_ENCRIPTADOS).blob(result["blob"])
+        upload_encrypted(input_file=input_file, blob=blob, key=key, key_id=key_id, job_name=job_name)
+    except Exception as error:
+        result["status"] = "error"
+        result["error"] = str(error)
+    result["duration"] = time.perf_counter() - start
+    return result
+
+# Encripta un batch de archivos en paralelo reutilizando los clientes y la key
+def main_batch(argv: list) -> int:
+    
+    parser = argparse.ArgumentParser(prog="encriptar.py --batch")
+    parser.add_argument("source", help="Directorio, glob o manifest con los archivos a encriptar")
+    parser.add_argument("job_name")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    args = parser.parse_args(argv)
+    
+    try:
+        files = resolve_batch_files(args.source)
+    except Exception as error:
+        print(f"Fallo (resolucion de los archivos): {str(error)}")
+        return -1
+    
+    logger = logging_client.logger(
+        name="batch",
+        labels={"proceso_id": PROCESO_ID, "name": "encriptar", "work_file": "batch", "enroute": "yes"},
+    )
+    logger.log_text(f"Se inicia el proceso de encriptacion de {len(files)} archivos.", severity="INFO")
+    
+    # La key (y su id) se obtiene una unica vez para todo el batch
+    try:
+        key, key_id = key_provider.get_encryption_key()
+    except Exception as error:
+        error = f"Fallo (obtencion del secret key): {str(error)}"
+        logger.log_text(error, severity="ERROR")
+        return -1
+    
+    # Los archivos con el mismo blob de destino fallan sin subirse
+    results = []
+    duplicates = find_duplicate_blobs(files)
+    for blob_name, blob_files in duplicates.items():
+        for input_file in blob_files:
+            error = f"{len(blob_files)} archivos van al mismo blob {blob_name}: {', '.join(blob_files)}"
+            results.append({"file": input_file, "blob": blob_name, "bytes": 0, "status": "error", "error": error, "duration": 0.0})
+            print(f"[error] {input_file}: {error}")
+            logger.log_text(f"Fallo (encriptacion de {input_file}): {error}", severity="ERROR")
+    files = [input_file for input_file in files if get_blob_name(input_file) not in duplicates]
+    
+    executor_class = ProcessPoolExecutor if args.executor == "process" else ThreadPoolExecutor
+    start = time.perf_counter()
+    with executor_class(max_workers=args.workers) as executor:
+        futures = [executor.submit(encrypt_batch_file, input_file, key, key_id, args.job_name) for input_file in files]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result["status"] == "ok":
+                print(f"[ok] {result['file']} -> {result['blob']} ({result['duration']:.2f}s)")
+            else:
+                print(f"[error] {result['file']}: {result['error']}")
+                logger.log_text(f"Fallo (encriptacion de {result['file']}): {result['error']}", severity="ERROR")
+    
+    duration = time.perf_counter() - start
+    failed = [result for result in results if result["status"] != "ok"]
+    total_mb = sum(result["bytes"] for result in results if result["status"] == "ok") / (1024 * 1024)
+    summary = (
+        f"Batch terminado: {len(results) - len(failed)} ok, {len(failed)} con error en {duration:.2f}s "
+        f"({len(results) / duration if duration else 0:.2f} archivos/s, {total_mb / duration if duration else 0:.2f} MB/s)"
+    )
+    print(summary)
+    logger.log_text(summary, severity="ERROR" if failed else "INFO")
+    return -1 if failed else 1
+
 def main() -> int:
     
     # 1 = Success | -1 = Failure 
@@ -66,6 +215,10 @@ def main() -> int:
         print("Se deben setear las variables de entorno.")
         return -1
     
+    # Modo batch: encriptar.py --batch <directorio|glob|manifest> <job_name> [--workers N] [--executor thread|process]
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        return main_batch(sys.argv[2:])
+    
     # Se debe pasar como argumento el path del archivo a encriptar.
     if len(sys.argv) != 3:
         print("Se debe pasar como argumento el path del archivo a encriptar.")
@@ -96,20 +249,10 @@ def main() -> int:
     # print("Se inicia el proceso de encriptacion.")
     logger.log_text("Se inicia el proceso de encriptacion.", severity="INFO")
     
-    # print("Se procede a comprimir el archivo.")
-    # # logger.log_text("Se procede a comprimir el archivo.", severity="INFO")
-    # try:
-    #     gzip_path = compress_data(input_file=input_file)
-    # except Exception as error:
-    #     error = f"Fallo (comprension del archivo): {str(error)}"
-    #     print(error)
-    #     # logger.log_text(error, severity="ERROR")
-    #     return -1
-    
     # print("Se procede a crear un blob object para almacenar el contenido encriptado.")
     logger.log_text("Se procede a crear un blob object para almacenar el contenido encriptado.", severity="INFO")
     try:
-        blob_name = "data/" + START_DATE + "/" + os.path.basename(input_file).split(".")[0] + ".encrypted"
+        blob_name = get_blob_name(input_file)
         bucket = storage_client.get_bucket(BUCKET_ENCRIPTADOS)
         blob = bucket.blob(blob_name)
     except Exception as error:
@@ -121,10 +264,7 @@ def main() -> int:
     # print("Se procede a obtener la key para encriptar el archivo")
     logger.log_text("Se procede a obtener la key para encriptar el archivo", severity="INFO")
     try:
-        name = f"projects/{PROJECT_ID}/secrets/{SECRET_KEY}/versions/latest"
-        response_secret = secret_client.access_secret_version(name=name)
-        secret_value = response_secret.payload.data.decode("UTF-8")
-        key = secret_value # base64.b64decode(secret_value)
+        key, key_id = key_provider.get_encryption_key()
     except Exception as error:
         error = f"Fallo (obtencion del secret key): {str(error)}"
         # print(error)
@@ -134,11 +274,7 @@ def main() -> int:
     # print("Se procede a encriptar el archivo comprimido")
     logger.log_text("Se procede a encriptar el archivo comprimido", severity="INFO")
     try:
-        blob = encrypt_data(input_file=input_file, blob=blob, key=key)
-        metageneration_match_precondition = None
-        metageneration_match_precondition = blob.metageneration
-        blob.metadata = {"proceso_id": PROCESO_ID, "job_name": job_name}
-        blob.patch(if_metageneration_match=metageneration_match_precondition)
+        blob = upload_encrypted(input_file=input_file, blob=blob, key=key, key_id=key_id, job_name=job_name)
     except Exception as error:
         error = f"Fallo (encriptacion del archivo): {str(error)}"
         # print(error)
@@ -1,54 +1,330 @@
 import argparse
 import io
 import logging
-from typing import MutableSequence
+import threading
+import functools
+from contextlib import contextmanager
+from typing import Callable, MutableSequence
+from concurrent.futures import ThreadPoolExecutor
 
 import apache_beam as beam
 from apache_beam.io import fileio
+from apache_beam.io.filesystem import CompressionTypes
+from apache_beam.io.filesystems import FileSystems
 from apache_beam.options.pipeline_options import PipelineOptions
 from apache_beam.ml.inference.base import ModelHandler, RunInference
 
+from google.api_core import exceptions as api_exceptions
 from google.cloud import vision
 from google.cloud.vision import ImageAnnotatorClient, Feature
 
+from vision_cache import ResultCache, build_result_cache, cache_key
+from vision_requests import call_with_backoff, split_requests
+
 
 PROJECT = ""
 IMAGE_PATH_PATTERN = ""
 
+# Limites por request de batch_annotate_images: 16 imagenes y ~10MB de payload (con margen para el overhead)
+MAX_IMAGES_PER_REQUEST = 16
+MAX_REQUEST_BYTES = 8 * 1024 * 1024
+# Errores de cuota / disponibilidad que se reintentan con backoff
+RETRYABLE_ERRORS = (
+    api_exceptions.ResourceExhausted,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.InternalServerError,
+)
+
+
+# Limita los bytes de imagenes en memoria en simultaneo por worker (proceso), compartido por todos
+# los threads. Una reserva mas grande que el limite se hace sola.
+class ByteBudget:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self.condition = threading.Condition()
+    
+    @contextmanager
+    def reserve(self, size: int):
+        size = min(size, self.max_bytes)
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight + size <= self.max_bytes)
+            self.in_flight += size
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight -= size
+                self.condition.notify_all()
+
+
+_byte_budget = None
+_byte_budget_lock = threading.Lock()
+
+def get_byte_budget(max_bytes: int) -> ByteBudget:
+    global _byte_budget
+    with _byte_budget_lock:
+        if _byte_budget is None:
+            _byte_budget = ByteBudget(max_bytes)
+        return _byte_budget
+
+
+# Un cache por configuracion (cache_kwargs) por worker (proceso). RunInference ejecuta load_model una
+# sola vez por proceso (shared.Shared), asi que las demas instancias del handler lo obtienen al usarlo.
+_result_caches = {}
+_result_caches_lock = threading.Lock()
+
+def get_result_cache(cache_kwargs: dict) -> ResultCache | None:
+    key = tuple(sorted(cache_kwargs.items()))
+    with _result_caches_lock:
+        if key not in _result_caches:
+            _result_caches[key] = build_result_cache(**cache_kwargs)
+        return _result_caches[key]
+
+
 class CloudVisionModelHandler(ModelHandler):
+    """Anota las imagenes con Cloud Vision. Si se define un cache (cache_kwargs para
+    build_result_cache), las respuestas se guardan por sha256 de la imagen + features y solo
+    se envian a la API las imagenes que no estan en el cache (una vez por contenido por batch).
+    Cada batch se divide en sub-requests que respetan los limites de la API (cantidad y bytes),
+    que se envian en paralelo con hasta max_workers threads y se reintentan con backoff si la
+    API devuelve un error de cuota o disponibilidad.
+    Con lazy_read los elementos son (path, size) y los bytes se leen recien aca, por sub-request y
+    en paralelo con fetch_workers threads. Los bytes de un sub-request cuentan en el budget de
+    max_in_flight_bytes por worker desde que se leen hasta que se anotan.
+    preprocess (p.ej. resize_image) se aplica en paralelo solo a las imagenes que no estan en el cache,
+    despues de calcular la clave con los bytes originales: cambiar el preprocesamiento no invalida el cache."""
+    
+    def __init__(self,
+                 feature_types: tuple = (Feature.Type.LABEL_DETECTION,),
+                 cache_kwargs: dict | None = None,
+                 max_workers: int = 4,
+                 max_images_per_request: int = MAX_IMAGES_PER_REQUEST,
+                 max_request_bytes: int = MAX_REQUEST_BYTES,
+                 max_retries: int = 5,
+                 initial_backoff: float = 1.0,
+                 lazy_read: bool = False,
+                 fetch_workers: int = 8,
+                 max_in_flight_bytes: int = 256 * 1024 * 1024,
+                 preprocess: Callable[[tuple[str, bytes]], tuple[str, bytes]] | None = None):
+        self.feature_types = feature_types
+        self.features_key = ",".join(sorted(Feature.Type(feature_type).name for feature_type in feature_types))
+        self.cache_kwargs = cache_kwargs or {"backend": "none"}
+        self.cache = None
+        self.max_workers = max_workers
+        self.max_images_per_request = max_images_per_request
+        self.max_request_bytes = max_request_bytes
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.executor = None
+        self.lazy_read = lazy_read
+        self.fetch_workers = fetch_workers
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.preprocess = preprocess
+        self.fetch_executor = None
     
     def load_model(self) -> ImageAnnotatorClient:
+        self.cache = get_result_cache(self.cache_kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        if self.lazy_read:
+            self.fetch_executor = ThreadPoolExecutor(max_workers=self.fetch_workers)
         client = ImageAnnotatorClient()
         return client
     
+    # Batches de Beam de hasta un sub-request por thread, para que todos los threads trabajen
+    def batch_elements_kwargs(self) -> dict:
+        return {"min_batch_size": 1, "max_batch_size": self.max_images_per_request * self.max_workers}
+    
     def run_inference(self, 
                       batch: tuple[str, bytes],
                       model: ImageAnnotatorClient, inference_args) -> tuple[str, MutableSequence[vision.AnnotateImageResponse]]:
         
-        feature = Feature()
-        feature.type_  = Feature.Type.LABEL_DETECTION
+        if not self.lazy_read:
+            return self.annotate_images(model, batch, self.annotate)
         
+        # Con lectura diferida cada sub-request lee sus imagenes recien cuando tiene un thread, y
+        # las mantiene dentro del budget hasta que termina de anotarlas
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        sub_batches = split_requests(
+            batch, self.max_images_per_request, self.max_request_bytes, size=lambda reference: reference[1]
+        )
+        futures = [self.executor.submit(self.annotate_references, model, sub_batch) for sub_batch in sub_batches]
+        return [result for future in futures for result in future.result()]
+    
+    # El cache del proceso, aunque esta instancia del handler no haya ejecutado load_model
+    def get_cache(self) -> ResultCache | None:
+        if self.cache is None:
+            self.cache = get_result_cache(self.cache_kwargs)
+        return self.cache
+    
+    # Devuelve (path, respuesta) por imagen. Se consulta el cache con la clave de los bytes originales
+    # y solo las imagenes que no estan (una por contenido) se preprocesan y se envian con annotate.
+    def annotate_images(self, model: ImageAnnotatorClient, batch: list, annotate: Callable) -> list:
         image_urls = [image_url for (image_url, image_bytes) in batch]
+        keys = [cache_key(image_bytes, self.features_key) for (_, image_bytes) in batch]
         
-        images = [vision.Image(content=image_bytes) for (_, image_bytes) in batch]
-        image_requests = [vision.AnnotateImageRequest(image=image, features=[feature]) for image in images]
+        cache = self.get_cache()
+        responses = get_cached_responses(cache, keys)
+        
+        # Solo las imagenes que no estan en el cache, una por contenido
+        misses = {}
+        for key, image in zip(keys, batch):
+            if key not in responses:
+                misses.setdefault(key, image)
+        
+        if misses:
+            images = self.preprocess_images(list(misses.values()))
+            annotated = dict(zip(misses, annotate(model, [image_bytes for _, image_bytes in images])))
+            responses.update(annotated)
+            put_cached_responses(cache, annotated)
+        
+        return [(image_url, responses[key]) for image_url, key in zip(image_urls, keys)]
+    
+    # Aplica preprocess en paralelo. Con lazy_read, annotate_images ya corre en un thread de executor,
+    # asi que se usa fetch_executor: esperar tareas del mismo pool puede bloquear todos sus threads.
+    def preprocess_images(self, images: list) -> list:
+        if not self.preprocess:
+            return images
+        if self.lazy_read:
+            if self.fetch_executor is None:
+                self.fetch_executor = ThreadPoolExecutor(max_workers=self.fetch_workers)
+            return list(self.fetch_executor.map(self.preprocess, images))
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return list(self.executor.map(self.preprocess, images))
+    
+    # Lee las imagenes de un sub-request (path, size) y las anota sin liberar el budget hasta terminar.
+    # Las referencias ya respetan los limites de un request, asi que las imagenes van en uno solo.
+    def annotate_references(self, model: ImageAnnotatorClient, references: list) -> list:
+        with get_byte_budget(self.max_in_flight_bytes).reserve(sum(size for _, size in references)):
+            images = self.fetch_images([image_path for image_path, _ in references])
+            return self.annotate_images(model, images, self.annotate_request)
+    
+    # Lee en paralelo los bytes de las imagenes, en el mismo orden
+    def fetch_images(self, image_paths: list) -> list:
+        if self.fetch_executor is None:
+            self.fetch_executor = ThreadPoolExecutor(max_workers=self.fetch_workers)
+        
+        return list(self.fetch_executor.map(self.fetch_image, image_paths))
+    
+    def fetch_image(self, image_path: str) -> tuple[str, bytes]:
+        with FileSystems.open(image_path, mime_type="image/jpeg", compression_type=CompressionTypes.UNCOMPRESSED) as finput:
+            return image_path, finput.read()
+    
+    # Envia las imagenes en sub-requests concurrentes y devuelve las respuestas en el mismo orden
+    def annotate(self, model: ImageAnnotatorClient, images_bytes: list) -> list:
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        
+        sub_batches = split_requests(images_bytes, self.max_images_per_request, self.max_request_bytes)
+        futures = [self.executor.submit(self.annotate_request, model, sub_batch) for sub_batch in sub_batches]
+        return [response for future in futures for response in future.result()]
+    
+    def annotate_request(self, model: ImageAnnotatorClient, images_bytes: list) -> list:
+        features = [Feature(type_=feature_type) for feature_type in self.feature_types]
+        images = [vision.Image(content=image_bytes) for image_bytes in images_bytes]
+        image_requests = [vision.AnnotateImageRequest(image=image, features=features) for image in images]
         batch_image_request = vision.BatchAnnotateImagesRequest(requests=image_requests)
+        
+        return call_with_backoff(
+            lambda: list(model.batch_annotate_images(request=batch_image_request).responses),
+            RETRYABLE_ERRORS,
+            max_retries=self.max_retries,
+            initial_backoff=self.initial_backoff,
+        )
+
+
+def get_cached_responses(cache: ResultCache | None, keys: list) -> dict:
+    if cache is None:
+        return {}
+    try:
+        cached = cache.get_many(list(set(keys)))
+    except Exception as error:
+        # El cache es una optimizacion: si falla, se consulta la API
+        logging.warning(f"No se pudo leer el cache de Cloud Vision: {error}")
+        return {}
+    return {key: vision.AnnotateImageResponse.deserialize(value) for key, value in cached.items()}
+
 
-        responses = model.batch_annotate_images(request=batch_image_request).responses
-        return list(zip(image_urls, responses))
+# Se guardan solo las respuestas sin error, para reintentarlas en la proxima ejecucion
+def put_cached_responses(cache: ResultCache | None, responses: dict) -> None:
+    if cache is None:
+        return
+    items = {
+        key: vision.AnnotateImageResponse.serialize(response)
+        for key, response in responses.items()
+        if not response.error.code
+    }
+    try:
+        cache.put_many(items)
+    except Exception as error:
+        logging.warning(f"No se pudo escribir el cache de Cloud Vision: {error}")
         
 
+# Para lazy_read: solo el path y el tamano, los bytes se leen en el handler
+def image_reference(metadata) -> tuple[str, int]:
+    return metadata.path, metadata.size_in_bytes
+
+
 def read_image(image: fileio.ReadableFile) -> tuple[str, bytes]:
     image_bytes = image.open(mime_type="image/jpeg").read()
     return image.metadata.path, image_bytes
 
 
+# Reduce la imagen a max_edge pixeles en el lado mayor y la re-encoda como JPEG. LABEL_DETECTION no
+# necesita la resolucion completa y el payload (y la latencia de la API) bajan proporcionalmente.
+# Las imagenes de hasta min_bytes o que ya entran en max_edge se devuelven sin cambios.
+# Requiere Pillow (ver requirements.txt).
+def resize_image(image: tuple[str, bytes], max_edge: int = 1024, min_bytes: int = 256 * 1024, quality: int = 85) -> tuple[str, bytes]:
+    image_path, image_bytes = image
+    if not max_edge or len(image_bytes) <= min_bytes:
+        return image
+    
+    from PIL import Image
+    
+    try:
+        picture = Image.open(io.BytesIO(image_bytes))
+        if max(picture.size) <= max_edge:
+            return image
+        # En JPEG, draft decodifica directamente a una escala reducida (mucho mas rapido que decodificar completo)
+        picture.draft("RGB", (max_edge, max_edge))
+        picture = picture.convert("RGB")
+        picture.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        picture.save(output, format="JPEG", quality=quality, optimize=True)
+    except Exception as error:
+        # Si no se puede decodificar se envia la original y la API reporta el error
+        logging.warning(f"No se pudo reducir la imagen {image_path}: {error}")
+        return image
+    
+    resized_bytes = output.getvalue()
+    return (image_path, resized_bytes) if len(resized_bytes) < len(image_bytes) else image
+
+
 def post_process(inference: tuple[str, MutableSequence[vision.AnnotateImageResponse]]):
     return f"{inference[0]},{','.join([label.description for label in inference[1].label_annotations])}"
 
 def run():
     
     parser = argparse.ArgumentParser()
+    # Cache de respuestas por contenido: none | sqlite (local) | datastore (compartido)
+    parser.add_argument("--cache_backend", default="none", choices=["none", "sqlite", "datastore"])
+    parser.add_argument("--cache_path", default="cloudvision_cache.db")
+    parser.add_argument("--cache_ttl_days", type=float, default=30)
+    parser.add_argument("--cache_max_mb", type=float, default=1024)
+    # Preprocesamiento (requiere Pillow): lado mayor maximo de las imagenes (0 = sin reducir, p.ej. 1024)
+    # y tamano minimo para reducirlas
+    parser.add_argument("--max_edge", type=int, default=0)
+    parser.add_argument("--min_resize_kb", type=int, default=256)
+    parser.add_argument("--jpeg_quality", type=int, default=85)
+    # Lectura diferida: los elementos llevan solo path y tamano y el handler lee los bytes
+    parser.add_argument("--lazy_read", action="store_true")
+    parser.add_argument("--fetch_workers", type=int, default=8)
+    parser.add_argument("--max_in_flight_mb", type=int, default=256)
+    # Sub-requests concurrentes a Cloud Vision por worker
+    parser.add_argument("--vision_workers", type=int, default=4)
     
     know_args, beam_args = parser.parse_known_args()
     beam_options = PipelineOptions(
@@ -57,14 +333,44 @@ def run():
         project=PROJECT
     )
     
+    cache_kwargs = {"backend": know_args.cache_backend, "ttl_seconds": know_args.cache_ttl_days * 24 * 3600}
+    if know_args.cache_backend == "sqlite":
+        cache_kwargs.update(sqlite_path=know_args.cache_path, max_bytes=int(know_args.cache_max_mb * 1024 * 1024))
+    if know_args.cache_backend == "datastore":
+        cache_kwargs.update(project=PROJECT or None)
+    
+    preprocess = None
+    if know_args.max_edge:
+        preprocess = functools.partial(
+            resize_image,
+            max_edge=know_args.max_edge,
+            min_bytes=know_args.min_resize_kb * 1024,
+            quality=know_args.jpeg_quality,
+        )
+    
     with beam.Pipeline(options=beam_options) as pipeline:
-        read_images = (pipeline 
-                    | fileio.MatchFiles(file_pattern=IMAGE_PATH_PATTERN, empty_match_treatment="ALLOW")
+        matches = (pipeline
+                    | fileio.MatchFiles(file_pattern=IMAGE_PATH_PATTERN, empty_match_treatment="ALLOW"))
+        
+        if know_args.lazy_read:
+            # Los bytes no pasan por el shuffle ni el batching: se leen en el handler
+            read_images = (matches
+                    | "ImageReferences" >> beam.Map(image_reference)
+                    | "ReshuffleReferences" >> beam.Reshuffle())
+        else:
+            read_images = (matches
                     | fileio.ReadMatches()
                     | beam.Map(read_image))
         
         inferences, error = (read_images
-                            | RunInference(model_handler=CloudVisionModelHandler()).with_exception_handling())
+                            | RunInference(model_handler=CloudVisionModelHandler(
+                                cache_kwargs=cache_kwargs,
+                                max_workers=know_args.vision_workers,
+                                lazy_read=know_args.lazy_read,
+                                fetch_workers=know_args.fetch_workers,
+                                max_in_flight_bytes=know_args.max_in_flight_mb * 1024 * 1024,
+                                preprocess=preprocess,
+                            )).with_exception_handling())
         
         (inferences
          | beam.Map(post_process)
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import time
+import sqlite3
+import datetime
+import hashlib
+import threading
+from typing import Optional
+
+
+# Clave del cache: el mismo contenido con el mismo set de features da la misma respuesta,
+# sin importar el path de la imagen
+def cache_key(image_bytes: bytes, features_key: str) -> str:
+    return f"{hashlib.sha256(image_bytes).hexdigest()}#{features_key}"
+
+
+# Interfaz del cache de resultados. Los valores son las respuestas serializadas (bytes).
+class ResultCache:
+    def get_many(self, keys: list) -> dict:
+        raise NotImplementedError
+
+    def put_many(self, items: dict) -> None:
+        raise NotImplementedError
+
+
+# Cache local en SQLite, para el DirectRunner y ejecuciones locales. Las entradas vencen a los
+# ttl_seconds y, si el total supera max_bytes, se eliminan las menos usadas recientemente.
+class SqliteResultCache(ResultCache):
+    def __init__(self, path: str = ":memory:", ttl_seconds: float = 30 * 24 * 3600, max_bytes: int = 1024 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results "
+            "(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)")
+
+    def get_many(self, keys: list) -> dict:
+        if not keys:
+            return {}
+        now = time.time()
+        placeholders = ",".join("?" * len(keys))
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT key, value FROM results WHERE key IN ({placeholders}) AND created_at > ?",
+                (*keys, now - self.ttl_seconds),
+            ).fetchall()
+            self.connection.executemany("UPDATE results SET accessed_at = ? WHERE key = ?", [(now, key) for key, _ in rows])
+        return dict(rows)
+
+    def put_many(self, items: dict) -> None:
+        if not items:
+            return
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO results (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    [(key, value, len(value), now, now) for key, value in items.items()],
+                )
+                self._evict(now)
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def _evict(self, now: float) -> None:
+        self.connection.execute("DELETE FROM results WHERE created_at <= ?", (now - self.ttl_seconds,))
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Se eliminan las entradas menos usadas hasta quedar por debajo del limite
+        evicted = []
+        for key, size in self.connection.execute("SELECT key, size FROM results ORDER BY accessed_at"):
+            evicted.append((key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self.connection.executemany("DELETE FROM results WHERE key = ?", evicted)
+
+
+# Cache en Datastore (Firestore en modo Datastore), compartido entre workers y ejecuciones en
+# produccion. El vencimiento se controla con expires_at (usarlo tambien como TTL policy del kind
+# para que Datastore elimine las entradas vencidas); el tamano lo maneja Datastore.
+class DatastoreResultCache(ResultCache):
+    # Limite de tamano de una entidad de Datastore (1 MiB), con margen para la key y las propiedades
+    MAX_VALUE_BYTES = 1000 * 1000
+
+    def __init__(self, kind: str = "vision_results", ttl_seconds: float = 30 * 24 * 3600, project: Optional[str] = None):
+        from google.cloud import datastore
+
+        self.kind = kind
+        self.ttl_seconds = ttl_seconds
+        self.client = datastore.Client(project=project)
+
+    def get_many(self, keys: list) -> dict:
+        if not keys:
+            return {}
+        now = datetime.datetime.now(datetime.timezone.utc)
+        entities = self.client.get_multi([self.client.key(self.kind, key) for key in keys])
+        return {entity.key.name: entity["value"] for entity in entities if entity["expires_at"] > now}
+
+    def put_many(self, items: dict) -> None:
+        from google.cloud import datastore
+
+        entities = []
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.ttl_seconds)
+        for key, value in items.items():
+            if len(value) > self.MAX_VALUE_BYTES:
+                continue
+            entity = datastore.Entity(key=self.client.key(self.kind, key), exclude_from_indexes=("value",))
+            entity.update({"value": value, "expires_at": expires_at})
+            entities.append(entity)
+        if entities:
+            self.client.put_multi(entities)
+
+
+# Construye el cache indicado: none | sqlite | datastore
+def build_result_cache(
+    backend: str,
+    sqlite_path: str = ":memory:",
+    ttl_seconds: float = 30 * 24 * 3600,
+    max_bytes: int = 1024 * 1024 * 1024,
+    project: Optional[str] = None,
+) -> Optional[ResultCache]:
+    if backend == "none":
+        return None
+    if backend == "sqlite":
+        return SqliteResultCache(sqlite_path, ttl_seconds=ttl_seconds, max_bytes=max_bytes)
+    if backend == "datastore":
+        return DatastoreResultCache(ttl_seconds=ttl_seconds, project=project)
+    raise ValueError(f"Cache no soportado: {backend}")
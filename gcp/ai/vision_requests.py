@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import time
+import random
+import logging
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+# Divide las imagenes en grupos consecutivos de hasta max_images y max_bytes (una imagen mas
+# grande que max_bytes va sola en su grupo). size devuelve los bytes de cada elemento (por
+# defecto los elementos son los bytes de la imagen)
+def split_requests(images: list, max_images: int, max_bytes: int, size: Callable[[Any], int] = len) -> list:
+    sub_batches = []
+    current = []
+    current_bytes = 0
+    for image in images:
+        image_size = size(image)
+        if current and (len(current) == max_images or current_bytes + image_size > max_bytes):
+            sub_batches.append(current)
+            current = []
+            current_bytes = 0
+        current.append(image)
+        current_bytes += image_size
+    if current:
+        sub_batches.append(current)
+    return sub_batches
+
+
+# Ejecuta request y, si lanza uno de retryable_errors, lo reintenta hasta max_retries veces con
+# backoff exponencial con jitter (para no sincronizar los reintentos de los threads)
+def call_with_backoff(
+    request: Callable[[], T],
+    retryable_errors: tuple,
+    max_retries: int = 5,
+    initial_backoff: float = 1.0,
+    sleep: Callable[[float], None] = time.sleep,
+) -> T:
+    for attempt in range(max_retries + 1):
+        try:
+            return request()
+        except retryable_errors as error:
+            if attempt == max_retries:
+                raise
+            backoff = initial_backoff * 2 ** attempt * (0.5 + random.random())
+            logging.warning(f"Cloud Vision: {error}. Reintento {attempt + 1} en {backoff:.1f}s")
+            sleep(backoff)
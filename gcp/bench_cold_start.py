@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Mide el import de desencriptar.py y el primer uso de la key (cold start) en un interprete nuevo.
+# Uso: python bench_cold_start.py [--runs 10] [--max-import-ms 300]
+COLD_START_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import desencriptar
+imported = time.perf_counter()
+desencriptar.key_provider.get_fernet()
+first_key = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "first_key_ms": (first_key - imported) * 1000}))
+"""
+
+
+def measure(runs: int) -> dict:
+    from cryptography.fernet import Fernet
+
+    env = dict(os.environ, SECRET_KEY=Fernet.generate_key().decode("UTF-8"))
+    env.pop("SECRET_KEY_NAME", None)
+    cwd = os.path.dirname(os.path.abspath(__file__))
+
+    results = {"import_ms": [], "first_key_ms": [], "total_ms": []}
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT], cwd=cwd, env=env, check=True, capture_output=True, text=True
+        )
+        run = json.loads(output.stdout.strip().splitlines()[-1])
+        results["import_ms"].append(run["import_ms"])
+        results["first_key_ms"].append(run["first_key_ms"])
+        results["total_ms"].append(run["import_ms"] + run["first_key_ms"])
+    return {metric: statistics.median(values) for metric, values in results.items()}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-import-ms", type=float, default=None, help="Falla si la mediana del import lo supera")
+    args = parser.parse_args()
+
+    medians = measure(args.runs)
+    for metric, value in medians.items():
+        print(f"{metric}: {value:.1f} ms (mediana de {args.runs})")
+
+    if args.max_import_ms is not None and medians["import_ms"] > args.max_import_ms:
+        print(f"Regresion: import_ms {medians['import_ms']:.1f} > {args.max_import_ms}")
+        return -1
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() == 1 else 1)
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import uuid
+import threading
+from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+
+# Solo se usa el tipo: el writer recibe el blob ya construido (o un fake en los tests)
+if TYPE_CHECKING:
+    from google.cloud import storage
+
+# GCS permite componer como maximo 32 objetos por request
+MAX_COMPOSE_SOURCES = 32
+
+
+# Stream de escritura que sube el contenido en partes concurrentes y al cerrar
+# las compone en el blob final. Las partes temporales (y los objetos intermedios
+# de la composicion) se eliminan siempre.
+# En memoria hay como maximo (workers + 1) partes de part_size bytes.
+class ParallelCompositeWriter:
+    def __init__(self, blob: storage.Blob, part_size: int = 64 * 1024 * 1024, workers: int = 8, temp_prefix: str = "tmp"):
+        self.blob = blob
+        # Prefijo unico por writer: dos uploads concurrentes nunca comparten partes
+        self.prefix = f"{temp_prefix}/{uuid.uuid4().hex}"
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.parts = []
+        self.futures = []
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+    
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            self._submit_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+    
+    def _temporary_blob(self) -> storage.Blob:
+        temporary = self.blob.bucket.blob(f"{self.prefix}/{len(self.parts):05d}")
+        self.parts.append(temporary)
+        return temporary
+    
+    def _submit_part(self, data: bytes) -> None:
+        part = self._temporary_blob()
+        # Backpressure: se bloquea hasta que haya un worker libre
+        self.slots.acquire()
+        future = self.executor.submit(part.upload_from_string, data, content_type="application/octet-stream")
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+    
+    def close(self) -> None:
+        try:
+            if self.buffer or not self.parts:
+                self._submit_part(bytes(self.buffer))
+                self.buffer.clear()
+            for future in self.futures:
+                future.result()
+            
+            # Se compone en arbol sobre objetos temporales para que el blob final
+            # se escriba una unica vez (un solo evento finalize).
+            sources = list(self.parts)
+            while len(sources) > MAX_COMPOSE_SOURCES:
+                intermediates = []
+                for start in range(0, len(sources), MAX_COMPOSE_SOURCES):
+                    intermediate = self._temporary_blob()
+                    intermediate.compose(sources[start:start + MAX_COMPOSE_SOURCES])
+                    intermediates.append(intermediate)
+                sources = intermediates
+            self.blob.content_type = "application/octet-stream"
+            self.blob.compose(sources)
+        finally:
+            self.abort()
+    
+    def abort(self) -> None:
+        self.executor.shutdown(wait=True)
+        for part in self.parts:
+            try:
+                part.delete()
+            except Exception:
+                pass
+        self.parts = []
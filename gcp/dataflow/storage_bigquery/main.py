@@ -1,3 +1,4 @@
+import uuid
 import argparse
 import logging
 
@@ -7,7 +8,7 @@ from apache_beam.options.pipeline_options import PipelineOptions
 from company_pkg.models import utils as models_utils
 from company_pkg.models.dim import raw as dimRawModels
 
-from storage_bigquery import transforms, dofns, utils
+from storage_bigquery import transforms as storage_bigquery_transforms, dofns, incremental, utils
 
 def run():
     
@@ -16,10 +17,29 @@ def run():
     # Se crea el argumento input
     parser = argparse.ArgumentParser()
     
-    # gs://bucket/folder1/folder2/lkp_fechas.txt
-    parser.add_argument("--input", required=True, type=str)
+    # gs://bucket/folder1/folder2/lkp_fechas.txt o un glob, p.ej. gs://bucket/folder1/2024-01-01/*.txt
+    parser.add_argument("--input", required=False, type=str, default=None)
+    # Archivo con un path (o glob) por linea; se suma a --input. Con archivos de varios modelos
+    # se cargan todas las tablas en un mismo job (fan-out).
+    parser.add_argument("--manifest", required=False, type=str, default=None)
+    # Path local donde escribir los registros en JSON lines en lugar de BigQuery (pruebas con DirectRunner)
+    parser.add_argument("--local_sink", required=False, type=str, default=None)
+    # Destino de las lineas invalidas: tabla de errores (project:dataset.table) o path de GCS
+    parser.add_argument("--dead_letter_table", required=False, type=str, default=None)
+    parser.add_argument("--dead_letter_path", required=False, type=str, default=None)
+    # Cantidad maxima de lineas validadas juntas por worker (1 = fila por fila)
+    parser.add_argument("--batch_size", required=False, type=int, default=1000)
+    # Tabla de estado (project:dataset.table) para la carga incremental: se saltean los archivos
+    # sin cambios y de los modelos append solo se carga la cola nueva
+    parser.add_argument("--state_table", required=False, type=str, default=None)
+    # Numero de linea en el dead letter. Cada archivo se lee completo en un unico worker (sin dividirlo)
+    # y se agrega un shuffle de todas las lineas; la carga incremental lo activa siempre
+    # (true/false, como lo pasan los parametros del template)
+    parser.add_argument("--line_numbers", required=False, type=str, default="false")
     
     known_args, beam_args = parser.parse_known_args()
+    if not (known_args.input or known_args.manifest):
+        parser.error("Se debe indicar --input o --manifest")
     beam_options = PipelineOptions(
         beam_args,
         runner="DataflowRunner",
@@ -36,44 +56,143 @@ def run():
     project = beam_options.get_all_options()["project"]
     temp_location = beam_options.get_all_options()["temp_location"]
     
+    logging.info(f"Todos los modelos en sigma_coa.dim.raw son: {str(dir(dimRawModels))}")
+    
+    # Construimos el nombre del modelo asociado a cada archivo
+    logging.info("Obteniendo los modelos asociados al input")
+    files = utils.expand_input_files(known_args.input, known_args.manifest)
+    if not files:
+        raise ValueError(f"No hay archivos para el input {known_args.input} / manifest {known_args.manifest}")
+    file_model_names = {file: models_utils.construct_model_name(file) for file in files}
+    # Obtenemos los modelos, esto es, las clases
+    models = {model_name: models_utils.select_model(model_name) for model_name in set(file_model_names.values())}
+    # Lineas a saltear de cada archivo: el header de su modelo
+    skip_lines = {file: int(models[model_name].__header__) for file, model_name in file_model_names.items()}
+    
+    # Carga incremental: se comparan generation/md5 con la tabla de estado
+    if known_args.state_table:
+        from google.cloud import bigquery
+        
+        bigquery_client = bigquery.Client(project=project)
+        fingerprints = incremental.file_fingerprints(files)
+        state = incremental.read_state(bigquery_client, known_args.state_table, files)
+        skip_lines = incremental.plan_incremental(file_model_names, models, fingerprints, state)
+        logging.info(f"Carga incremental: {len(skip_lines)} de {len(files)} archivos a cargar")
+        if not skip_lines:
+            logging.info("No hay archivos con cambios. No se ejecuta el pipeline")
+            return
+        files = sorted(skip_lines)
+        file_model_names = {file: file_model_names[file] for file in files}
+        models = {model_name: models[model_name] for model_name in set(file_model_names.values())}
+        line_counts_path = f"{temp_location.rstrip('/')}/incremental/{uuid.uuid4().hex}"
+    
+    # Los archivos de modelos con __quotechar__ se leen por registro con el modulo csv
+    # (campos entre comillas con saltos de linea); el resto linea por linea
+    csv_dialects = {
+        file: models_utils.csv_dialect(models[model_name])
+        for file, model_name in file_model_names.items()
+        if getattr(models[model_name], "__quotechar__", None)
+    }
+    
     # Se inicia el pipeline
     with beam.Pipeline(options=beam_options) as pipeline:
         
-        logging.info(f"Todos los modelos en sigma_coa.dim.raw son: {str(dir(dimRawModels))}")
-        
-        # Construimos el nombre del modelo asociado al archivo
-        logging.info("Obteniendo el model asociado al input")
-        model_name = models_utils.construct_model_name(known_args.input)
-        # Obtenemos el modelo, esto es, la clase
-        model = models_utils.select_model(model_name)
-        logging.info(f"El modelo a usar es {model}. Procedemos a realizar el etl...")
-        
-        # Leemos el archivo
+        # Leemos los archivos
         logging.info("Extraemos la data")
-        read_data = pipeline | "ReadInputFile" >> beam.io.ReadFromText(known_args.input, skip_header_lines=int(model.__header__))
-        
-        # Transformamos
-        logging.info("Transformamos la data")
-        transforms = (read_data
-                        #| "RemoveEmptyRows" >> beam.Filter(utils.remove_empty, delimiter=model.__delimiter__)
-                        | "ParseRecordsIntoModel" >> beam.Map(models_utils.format_record, delimiter=model.__delimiter__, model=model)
-                        | "ParseModelIntoDict" >> beam.Map(lambda record: record.model_dump())
+        read_data = pipeline | "ReadInputFiles" >> storage_bigquery_transforms.ReadInputLines(
+            files,
+            skip_header_lines=skip_lines,
+            csv_dialects=csv_dialects,
+            line_numbers=known_args.line_numbers.lower() == "true" or bool(known_args.state_table),
         )
         
-        # Lo almacenamos en bigquery usando el metodo FILE_LOADS.
-        logging.info("Almacenamos la data")
-        output = (transforms
-                    | beam.io.WriteToBigQuery(
-                        method="FILE_LOADS",
-                        custom_gcs_temp_location=temp_location,
-                        project=project,
-                        dataset=model.__dataset__,
-                        table=model.__tablename__,
-                        write_disposition=model.__write_disposition__,
-                        create_disposition=model.__create_disposition__,
-                        schema=model.bigquery_schema(exclude=["default"]),
-                        )
+        if known_args.state_table:
+            line_counts = read_data | "LineCounts" >> incremental.WriteLineCounts(line_counts_path)
+        
+        if len(models) > 1:
+            logging.info(f"{len(files)} archivos de {len(models)} modelos. Procedemos a realizar el etl en fan-out...")
+            run_fan_out(read_data, known_args, models, project, temp_location)
+        else:
+            model_name, model = next(iter(models.items()))
+            run_single_model(read_data, known_args, model_name, model, project, temp_location)
+    
+    # El job termino bien: se registran los archivos cargados
+    if known_args.state_table:
+        tables = {file: dofns.table_destination(models[model_name]) for file, model_name in file_model_names.items()}
+        incremental.record_state(bigquery_client, known_args.state_table, skip_lines, tables, fingerprints, line_counts_path)
+
+
+def run_single_model(read_data, known_args, model_name: str, model, project: str, temp_location: str):
+    
+    logging.info(f"El modelo a usar es {model}. Procedemos a realizar el etl...")
+    
+    # Transformamos. Las lineas invalidas van al dead letter en lugar de fallar el bundle.
+    logging.info("Transformamos la data")
+    # Con batch_size > 1 se valida por batches con el modelo compilado en cada worker.
+    if known_args.batch_size > 1:
+        parsed = (read_data
+                    | "BatchLines" >> beam.BatchElements(min_batch_size=1, max_batch_size=known_args.batch_size)
+                    | "ParseRecordsIntoModel" >> beam.ParDo(dofns.ParseBatchDoFn(model_name)).with_outputs(
+                        dofns.ParseBatchDoFn.DEAD_LETTER, main="rows"
+                    )
         )
+    else:
+        parsed = (read_data
+                    | "ParseRecordsIntoModel" >> beam.ParDo(dofns.ParseRecordDoFn(model)).with_outputs(
+                        dofns.ParseRecordDoFn.DEAD_LETTER, main="rows"
+                    )
+        )
+    transforms = parsed.rows
+    
+    logging.info("Almacenamos los registros invalidos")
+    dead_letter = (parsed[dofns.ParseRecordDoFn.DEAD_LETTER]
+                    | "WriteDeadLetter" >> storage_bigquery_transforms.WriteDeadLetter(
+                        gcs_path=known_args.dead_letter_path or f"{temp_location.rstrip('/')}/dead_letter/{model.__tablename__}",
+                        table=known_args.dead_letter_table,
+                    )
+    )
+    
+    # Lo almacenamos en bigquery con el metodo definido en el modelo (__write_method__).
+    logging.info(f"Almacenamos la data con el metodo {model.__write_method__}")
+    output = (transforms
+                | "WriteToBigQuery" >> storage_bigquery_transforms.WriteModelToBigQuery(
+                    model=model,
+                    project=project,
+                    temp_location=temp_location,
+                    local_sink=known_args.local_sink,
+                    )
+    )
+
+
+def run_fan_out(read_data, known_args, models: dict, project: str, temp_location: str):
+    
+    # Transformamos: cada linea se valida con el modelo de su archivo y sale como (destination, row)
+    logging.info("Transformamos la data")
+    parsed = (read_data
+                | "BatchLines" >> beam.BatchElements(min_batch_size=1, max_batch_size=max(known_args.batch_size, 1))
+                | "ParseRecordsIntoModels" >> beam.ParDo(dofns.ParseFilesBatchDoFn()).with_outputs(
+                    dofns.ParseFilesBatchDoFn.DEAD_LETTER, main="rows"
+                )
+    )
+    
+    logging.info("Almacenamos los registros invalidos")
+    dead_letter = (parsed[dofns.ParseFilesBatchDoFn.DEAD_LETTER]
+                    | "WriteDeadLetter" >> storage_bigquery_transforms.WriteDeadLetter(
+                        gcs_path=known_args.dead_letter_path or f"{temp_location.rstrip('/')}/dead_letter/fan_out",
+                        table=known_args.dead_letter_table,
+                    )
+    )
+    
+    # Lo almacenamos en bigquery, un load job por tabla
+    logging.info(f"Almacenamos la data en {len(models)} tablas")
+    output = (parsed.rows
+                | "WriteToBigQuery" >> storage_bigquery_transforms.WriteFanOutToBigQuery(
+                    models=list(models.values()),
+                    project=project,
+                    temp_location=temp_location,
+                    local_sink=known_args.local_sink,
+                    )
+    )
     
 if __name__ == "__main__":
     run()
\ No newline at end of file
@@ -0,0 +1,213 @@
+import datetime
+import logging
+
+import apache_beam as beam
+from apache_beam.io.filesystems import FileSystems
+from apache_beam.metrics import Metrics
+from apache_beam.pvalue import TaggedOutput
+
+from company_pkg.models import utils as models_utils
+
+METRICS_NAMESPACE = "storage_bigquery"
+
+
+class LoadParquetToBigQueryDoFn(beam.DoFn):
+    """Recibe la lista completa de archivos parquet escritos en el temp location y los carga
+    en la tabla con un unico load job. Luego elimina los archivos temporales."""
+
+    def __init__(self, project: str, dataset: str, table: str, schema: dict, write_disposition: str, create_disposition: str):
+        self.project = project
+        self.dataset = dataset
+        self.table = table
+        self.schema = schema
+        self.write_disposition = write_disposition
+        self.create_disposition = create_disposition
+
+    def setup(self):
+        from google.cloud import bigquery
+
+        self.client = bigquery.Client(project=self.project)
+
+    def process(self, files: list):
+        job = run_load_job(
+            self.client,
+            files,
+            destination=f"{self.project}.{self.dataset}.{self.table}",
+            schema=self.schema,
+            source_format="PARQUET",
+            write_disposition=self.write_disposition,
+            create_disposition=self.create_disposition,
+        )
+        if job is not None:
+            yield job.job_id
+
+
+class LoadFilesToBigQueryDoFn(beam.DoFn):
+    """Recibe (destination, files) con los archivos escritos para cada tabla y los carga con un
+    load job por tabla. destinations tiene, por cada "dataset.table", el schema y las
+    dispositions del modelo, resueltos al construir el grafo."""
+
+    def __init__(self, project: str, destinations: dict, source_format: str = "NEWLINE_DELIMITED_JSON"):
+        self.project = project
+        self.destinations = destinations
+        self.source_format = source_format
+
+    def setup(self):
+        from google.cloud import bigquery
+
+        self.client = bigquery.Client(project=self.project)
+
+    def process(self, element: tuple):
+        destination, files = element
+        config = self.destinations[destination]
+        job = run_load_job(
+            self.client,
+            list(files),
+            destination=f"{self.project}.{destination}",
+            schema=config["schema"],
+            source_format=self.source_format,
+            write_disposition=config["write_disposition"],
+            create_disposition=config["create_disposition"],
+        )
+        if job is not None:
+            yield destination, job.job_id
+
+
+def run_load_job(client, files: list, destination: str, schema: dict, source_format: str, write_disposition: str, create_disposition: str):
+    """Carga los archivos en la tabla destination (project.dataset.table) con un unico load job
+    y luego elimina los archivos temporales. Devuelve el job o None si no hay archivos."""
+    from google.cloud import bigquery
+
+    files = sorted(files)
+    if not files:
+        logging.info(f"No hay archivos para cargar en {destination}")
+        return None
+
+    job_config = bigquery.LoadJobConfig(
+        source_format=source_format,
+        schema=[bigquery.SchemaField.from_api_repr(field) for field in schema["fields"]],
+        write_disposition=write_disposition,
+        create_disposition=create_disposition,
+    )
+    logging.info(f"Cargando {len(files)} archivos en {destination}")
+    job = client.load_table_from_uri(files, destination, job_config=job_config)
+    job.result()
+    logging.info(f"Load job {job.job_id} terminado: {job.output_rows} filas")
+
+    FileSystems.delete(files)
+    return job
+
+
+class ParseRecordDoFn(beam.DoFn):
+    """Parsea cada linea (file, line_number, line) con el modelo y devuelve el dict validado.
+    Las lineas invalidas no fallan el bundle: salen por el output DEAD_LETTER con el error
+    y el numero de linea, y se cuentan en las metricas parsed_rows / invalid_rows."""
+
+    DEAD_LETTER = "dead_letter"
+
+    def __init__(self, model):
+        self.model = model
+        self.parsed_rows = Metrics.counter(METRICS_NAMESPACE, "parsed_rows")
+        self.invalid_rows = Metrics.counter(METRICS_NAMESPACE, "invalid_rows")
+
+    def process(self, element: tuple):
+        file, line_number, line = element
+        try:
+            row = models_utils.format_record(line, delimiter=self.model.__delimiter__, model=self.model).model_dump()
+        except Exception as error:
+            self.invalid_rows.inc()
+            yield TaggedOutput(self.DEAD_LETTER, dead_letter_row(self.model, file, line_number, line, error))
+            return
+        self.parsed_rows.inc()
+        yield row
+
+
+class ParseBatchDoFn(beam.DoFn):
+    """Version en batch de ParseRecordDoFn: recibe listas de (file, line_number, line) (por ejemplo
+    de BatchElements) y las valida con el parser compilado del modelo en una sola llamada.
+    El modelo se resuelve por nombre y se compila una vez por worker en setup(), en lugar de
+    serializar la clase en el grafo. Si el batch tiene lineas invalidas se reprocesa fila por fila
+    para enviar solo esas al dead letter."""
+
+    DEAD_LETTER = ParseRecordDoFn.DEAD_LETTER
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.parsed_rows = Metrics.counter(METRICS_NAMESPACE, "parsed_rows")
+        self.invalid_rows = Metrics.counter(METRICS_NAMESPACE, "invalid_rows")
+        self.batches = Metrics.distribution(METRICS_NAMESPACE, "batch_size")
+
+    def setup(self):
+        self.parsers = {}
+        self.model, self.parser = self._compile(self.model_name)
+
+    def _compile(self, model_name: str) -> tuple:
+        if model_name not in self.parsers:
+            model = models_utils.select_model(model_name)
+            self.parsers[model_name] = (model, models_utils.compile_record_parser(model, model.__delimiter__))
+        return self.parsers[model_name]
+
+    def process(self, batch: list):
+        self.batches.update(len(batch))
+        yield from self._parse(batch, self.model, self.parser)
+
+    def _parse(self, batch: list, model, parser):
+        try:
+            rows = parser([line for _, _, line in batch])
+        except Exception:
+            yield from self._process_rows(batch, model, parser)
+            return
+        self.parsed_rows.inc(len(rows))
+        yield from rows
+
+    def _process_rows(self, batch: list, model, parser):
+        for file, line_number, line in batch:
+            try:
+                row = parser([line])[0]
+            except Exception as error:
+                self.invalid_rows.inc()
+                yield TaggedOutput(self.DEAD_LETTER, dead_letter_row(model, file, line_number, line, error))
+                continue
+            self.parsed_rows.inc()
+            yield row
+
+
+class ParseFilesBatchDoFn(ParseBatchDoFn):
+    """Version de ParseBatchDoFn para batches con lineas de distintos archivos (fan-out): el modelo
+    se resuelve por archivo con construct_model_name y se compila una vez por worker. Devuelve
+    (destination, row), con destination = "dataset.table" del modelo, para escribir cada registro
+    en su tabla."""
+
+    def __init__(self):
+        super().__init__(model_name=None)
+
+    def setup(self):
+        self.parsers = {}
+
+    def process(self, batch: list):
+        self.batches.update(len(batch))
+        by_model = {}
+        for element in batch:
+            by_model.setdefault(models_utils.construct_model_name(element[0]), []).append(element)
+
+        for model_name, elements in by_model.items():
+            model, parser = self._compile(model_name)
+            destination = table_destination(model)
+            for row in self._parse(elements, model, parser):
+                yield row if isinstance(row, TaggedOutput) else (destination, row)
+
+
+def table_destination(model) -> str:
+    return f"{model.__dataset__}.{model.__tablename__}"
+
+
+def dead_letter_row(model, file: str, line_number: int | None, line: str, error: Exception) -> dict:
+    return {
+        "table": table_destination(model),
+        "file": file,
+        "line_number": line_number,
+        "line": line,
+        "error_type": type(error).__name__,
+        "error": str(error),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
@@ -0,0 +1,172 @@
+import os
+import json
+import hashlib
+import logging
+import datetime
+
+import apache_beam as beam
+from apache_beam.io.filesystems import FileSystems
+
+
+# Tabla de estado de la carga incremental: una fila por archivo cargado (se lee la ultima por archivo).
+# line_count es la cantidad de lineas del archivo ya consumidas (header incluido).
+STATE_SCHEMA = {
+    "fields": [
+        {"name": "file", "type": "STRING", "mode": "REQUIRED"},
+        {"name": "table", "type": "STRING", "mode": "REQUIRED"},
+        {"name": "generation", "type": "STRING", "mode": "NULLABLE"},
+        {"name": "md5", "type": "STRING", "mode": "NULLABLE"},
+        {"name": "size", "type": "INT64", "mode": "NULLABLE"},
+        {"name": "line_count", "type": "INT64", "mode": "NULLABLE"},
+        {"name": "loaded_at", "type": "TIMESTAMP", "mode": "REQUIRED"},
+    ]
+}
+
+
+def file_fingerprints(files: list) -> dict:
+    """Devuelve {file: {"generation", "md5", "size"}} sin leer el contenido de los archivos de GCS
+    (metadata del objeto). Para archivos locales la generation es el mtime y el md5 se calcula."""
+    fingerprints = {}
+    storage_client = None
+    for file in files:
+        if file.startswith("gs://"):
+            if storage_client is None:
+                from google.cloud import storage
+
+                storage_client = storage.Client()
+            bucket_name, blob_name = file[len("gs://"):].split("/", 1)
+            blob = storage_client.bucket(bucket_name).get_blob(blob_name)
+            fingerprints[file] = {"generation": str(blob.generation), "md5": blob.md5_hash, "size": blob.size}
+        else:
+            stat = os.stat(file)
+            content_hash = hashlib.md5()
+            with open(file, "rb") as finput:
+                while chunk := finput.read(1024 * 1024):
+                    content_hash.update(chunk)
+            fingerprints[file] = {"generation": str(stat.st_mtime_ns), "md5": content_hash.hexdigest(), "size": stat.st_size}
+    return fingerprints
+
+
+def read_state(client, state_table: str, files: list) -> dict:
+    """Devuelve el ultimo estado registrado de cada archivo ({file: row}). Si la tabla no existe
+    todavia (primera carga) devuelve {}."""
+    from google.api_core.exceptions import NotFound
+    from google.cloud import bigquery
+
+    query = f"""
+        SELECT file, generation, md5, size, line_count
+        FROM `{state_table.replace(':', '.')}`
+        WHERE file IN UNNEST(@files)
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY file ORDER BY loaded_at DESC) = 1
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[bigquery.ArrayQueryParameter("files", "STRING", files)])
+    try:
+        return {row["file"]: dict(row) for row in client.query(query, job_config=job_config).result()}
+    except NotFound:
+        logging.info(f"La tabla de estado {state_table} no existe, se cargan todos los archivos")
+        return {}
+
+
+def is_unchanged(fingerprint: dict, state: dict | None) -> bool:
+    if state is None:
+        return False
+    if fingerprint["generation"] == state["generation"]:
+        return True
+    return bool(fingerprint["md5"]) and fingerprint["md5"] == state["md5"]
+
+
+def plan_incremental(file_model_names: dict, models: dict, fingerprints: dict, state: dict) -> dict:
+    """Decide que archivos cargar y desde que linea: devuelve {file: lineas a saltear}.
+    - Los modelos append (WRITE_APPEND) cargan solo los archivos que cambiaron y, si el archivo
+      crecio, solo las lineas nuevas (la cola) a partir del line_count registrado.
+    - Los modelos WRITE_TRUNCATE se recargan completos (todos sus archivos) si alguno cambio, y se
+      saltean si ninguno cambio, porque cargar un subconjunto truncaria el resto de la tabla."""
+    files_by_model = {}
+    for file, model_name in file_model_names.items():
+        files_by_model.setdefault(model_name, []).append(file)
+
+    plan = {}
+    for model_name, files in files_by_model.items():
+        model = models[model_name]
+        header = int(model.__header__)
+        changed = [file for file in files if not is_unchanged(fingerprints[file], state.get(file))]
+        if not changed:
+            logging.info(f"{model_name}: {len(files)} archivos sin cambios, se saltean")
+            continue
+
+        if model.__write_disposition__ != "WRITE_APPEND":
+            plan.update({file: header for file in files})
+            continue
+
+        for file in changed:
+            previous = state.get(file)
+            if previous is not None and previous["line_count"] and fingerprints[file]["size"] >= (previous["size"] or 0):
+                plan[file] = max(header, previous["line_count"])
+            else:
+                if previous is not None:
+                    logging.warning(f"{file} es mas chico que en la carga anterior, se carga completo")
+                plan[file] = header
+    return plan
+
+
+class WriteLineCounts(beam.PTransform):
+    """Escribe en path (JSON lines) la ultima linea leida de cada archivo a partir de los
+    (file, line_number, line) leidos, para registrarla en la tabla de estado al terminar el job."""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+
+    def expand(self, pcoll):
+        return (
+            pcoll
+            | "FileLineNumber" >> beam.Map(lambda element: (element[0], element[1]))
+            | "LastLinePerFile" >> beam.CombinePerKey(max)
+            | "LineCountToJson" >> beam.MapTuple(lambda file, line_count: json.dumps({"file": file, "line_count": line_count}))
+            | "WriteLineCounts" >> beam.io.WriteToText(file_path_prefix=f"{self.path.rstrip('/')}/line_counts", file_name_suffix=".jsonl")
+        )
+
+
+def read_line_counts(paths: list) -> dict:
+    line_counts = {}
+    for path in paths:
+        with FileSystems.open(path) as finput:
+            for line in finput.read().decode("utf-8").splitlines():
+                row = json.loads(line)
+                line_counts[row["file"]] = row["line_count"]
+    return line_counts
+
+
+def record_state(client, state_table: str, plan: dict, tables: dict, fingerprints: dict, line_counts_path: str) -> None:
+    """Registra en la tabla de estado los archivos cargados. Se llama cuando el job termino bien;
+    si falla, los archivos no quedan registrados y se vuelven a cargar en la proxima ejecucion."""
+    from google.cloud import bigquery
+
+    line_counts_files = [
+        metadata.path
+        for match in FileSystems.match([f"{line_counts_path.rstrip('/')}/line_counts*"])
+        for metadata in match.metadata_list
+    ]
+    line_counts = read_line_counts(line_counts_files)
+    loaded_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    rows = [
+        {
+            "file": file,
+            "table": tables[file],
+            "generation": fingerprints[file]["generation"],
+            "md5": fingerprints[file]["md5"],
+            "size": fingerprints[file]["size"],
+            "line_count": max(skip_lines, line_counts.get(file, 0)),
+            "loaded_at": loaded_at,
+        }
+        for file, skip_lines in plan.items()
+    ]
+    job_config = bigquery.LoadJobConfig(
+        schema=[bigquery.SchemaField.from_api_repr(field) for field in STATE_SCHEMA["fields"]],
+        write_disposition="WRITE_APPEND",
+        create_disposition="CREATE_IF_NEEDED",
+    )
+    client.load_table_from_json(rows, state_table.replace(":", "."), job_config=job_config).result()
+    if line_counts_files:
+        FileSystems.delete(line_counts_files)
+    logging.info(f"Registrados {len(rows)} archivos en {state_table}")
@@ -0,0 +1,370 @@
+import csv
+import json
+import uuid
+
+import io
+import itertools
+import logging
+from typing import Callable
+
+import apache_beam as beam
+from apache_beam.io import fileio
+from apache_beam.io.parquetio import WriteToParquet
+from apache_beam.options.pipeline_options import StandardOptions
+
+from storage_bigquery.dofns import LoadFilesToBigQueryDoFn, LoadParquetToBigQueryDoFn, table_destination
+
+
+DEAD_LETTER_SCHEMA = {
+    "fields": [
+        {"name": "table", "type": "STRING", "mode": "REQUIRED"},
+        {"name": "file", "type": "STRING", "mode": "REQUIRED"},
+        {"name": "line_number", "type": "INT64", "mode": "NULLABLE"},
+        {"name": "line", "type": "STRING", "mode": "NULLABLE"},
+        {"name": "error_type", "type": "STRING", "mode": "NULLABLE"},
+        {"name": "error", "type": "STRING", "mode": "NULLABLE"},
+        {"name": "created_at", "type": "TIMESTAMP", "mode": "NULLABLE"},
+    ]
+}
+
+
+def read_numbered_lines(
+    readable_file: fileio.ReadableFile,
+    skip_header_lines: int | Callable[[str], int] = 0,
+    csv_dialect: dict | Callable[[str], dict | None] | None = None,
+):
+    """Devuelve (file, line_number, line) por cada linea no vacia del archivo (line_number desde 1).
+    skip_header_lines puede ser una funcion path -> lineas de header, si varia por archivo.
+    Con csv_dialect (parametros del modulo csv, o una funcion path -> parametros o None) cada
+    elemento es un registro completo: un campo entre comillas puede ocupar varias lineas y
+    line_number es la ultima linea del registro, para que el conteo de lineas leidas siga
+    siendo valido en la carga incremental."""
+    path = readable_file.metadata.path
+    if callable(skip_header_lines):
+        skip_header_lines = skip_header_lines(path)
+    if callable(csv_dialect):
+        csv_dialect = csv_dialect(path)
+    with io.TextIOWrapper(readable_file.open(), encoding="utf-8", newline="") as finput:
+        if csv_dialect:
+            yield from read_numbered_records(path, finput, skip_header_lines, csv_dialect)
+            return
+        for line_number, line in enumerate(finput, start=1):
+            line = line.rstrip("\r\n")
+            if line_number > skip_header_lines and line.strip():
+                yield path, line_number, line
+
+
+def read_numbered_records(path: str, finput: io.TextIOBase, skip_header_lines: int, csv_dialect: dict):
+    """Agrupa las lineas de finput en registros con el modulo csv y devuelve (path, line_number,
+    registro) con el texto original del registro. Si el archivo termina con una comilla sin
+    cerrar, el resto del archivo sale como un unico registro para que vaya al dead letter."""
+    lines = []
+
+    def source():
+        for line in finput:
+            lines.append(line)
+            yield line
+
+    for _ in itertools.islice(finput, skip_header_lines):
+        pass
+    reader = csv.reader(source(), **csv_dialect)
+    while True:
+        try:
+            if next(reader, None) is None:
+                return
+        except csv.Error:
+            record = "".join(lines).rstrip("\r\n")
+            yield path, skip_header_lines + reader.line_num, record
+            return
+        record = "".join(lines).rstrip("\r\n")
+        lines.clear()
+        if record.strip():
+            yield path, skip_header_lines + reader.line_num, record
+
+
+class ReadLinesWithNumbers(beam.PTransform):
+    """Lee los archivos del pattern (o de la lista de patterns/archivos) conservando el numero de
+    linea (para el dead letter) y redistribuye las lineas para que el parseo se haga en paralelo
+    en todos los workers. Con csv_dialect los archivos se leen por registro (ver read_numbered_lines).
+    Cada archivo se lee completo en un unico worker y el Reshuffle mueve todas las lineas: cuando el
+    numero de linea no hace falta, ReadInputLines usa la lectura divisible de ReadAllFromText."""
+
+    def __init__(
+        self,
+        file_pattern: str | list,
+        skip_header_lines: int | Callable[[str], int] = 0,
+        csv_dialect: dict | Callable[[str], dict | None] | None = None,
+    ):
+        super().__init__()
+        self.file_patterns = [file_pattern] if isinstance(file_pattern, str) else list(file_pattern)
+        self.skip_header_lines = skip_header_lines
+        self.csv_dialect = csv_dialect
+
+    def expand(self, pbegin):
+        return (
+            pbegin
+            | "FilePatterns" >> beam.Create(self.file_patterns)
+            | "MatchAll" >> fileio.MatchAll()
+            | "ReadMatches" >> fileio.ReadMatches()
+            | "ReadNumberedLines" >> beam.FlatMap(
+                read_numbered_lines, skip_header_lines=self.skip_header_lines, csv_dialect=self.csv_dialect
+            )
+            | "Reshuffle" >> beam.Reshuffle()
+        )
+
+
+class ReadInputLines(beam.PTransform):
+    """Lee los archivos de entrada como (file, line_number, line).
+    - Sin line_numbers, los archivos se leen con ReadAllFromText, que divide cada archivo entre los
+      workers (como ReadFromText). line_number queda en None (el dead letter registra el archivo y
+      la linea, sin el numero). Se aplica un ReadAllFromText por cantidad de lineas de header.
+    - Con line_numbers, y siempre para los archivos con csv_dialect (registros que pueden ocupar
+      varias lineas), se usa ReadLinesWithNumbers: cada archivo se lee completo en un unico worker y
+      las lineas se redistribuyen con un shuffle. Para un archivo grande la lectura es serial y el
+      shuffle agrega el costo de mover todas las lineas, por eso es opcional (la carga incremental
+      lo necesita para registrar las lineas leidas)."""
+
+    def __init__(self, files: list, skip_header_lines: dict, csv_dialects: dict | None = None, line_numbers: bool = False):
+        super().__init__()
+        self.files = files
+        self.skip_header_lines = skip_header_lines
+        self.csv_dialects = csv_dialects or {}
+        self.line_numbers = line_numbers
+
+    def expand(self, pbegin):
+        numbered_files = [file for file in self.files if self.line_numbers or file in self.csv_dialects]
+        files_by_header = {}
+        for file in self.files:
+            if file not in numbered_files:
+                files_by_header.setdefault(self.skip_header_lines.get(file, 0), []).append(file)
+
+        reads = []
+        if numbered_files:
+            reads.append(
+                pbegin
+                | "ReadNumberedFiles" >> ReadLinesWithNumbers(
+                    numbered_files, skip_header_lines=self.skip_header_lines.get, csv_dialect=self.csv_dialects.get
+                )
+            )
+        for skip_header_lines, files in sorted(files_by_header.items()):
+            reads.append(
+                pbegin
+                | f"FilePatterns{skip_header_lines}" >> beam.Create(files)
+                | f"ReadAllFromText{skip_header_lines}" >> beam.io.ReadAllFromText(
+                    skip_header_lines=skip_header_lines, with_filename=True
+                )
+                | f"SkipBlankLines{skip_header_lines}" >> beam.Filter(lambda element: element[1].strip())
+                | f"WithoutLineNumber{skip_header_lines}" >> beam.MapTuple(lambda file, line: (file, None, line))
+            )
+        if len(reads) == 1:
+            return reads[0]
+        return tuple(reads) | "FlattenReads" >> beam.Flatten()
+
+
+class WriteDeadLetter(beam.PTransform):
+    """Escribe los registros invalidos en una tabla de errores de BigQuery (project:dataset.table)
+    o, si no se define la tabla, como JSON lines en el path de GCS indicado."""
+
+    def __init__(self, gcs_path: str, table: str | None = None):
+        super().__init__()
+        self.gcs_path = gcs_path
+        self.table = table
+
+    def expand(self, pcoll):
+        if self.table:
+            return pcoll | "WriteDeadLetterBigQuery" >> beam.io.WriteToBigQuery(
+                table=self.table,
+                method="FILE_LOADS",
+                schema=DEAD_LETTER_SCHEMA,
+                write_disposition="WRITE_APPEND",
+                create_disposition="CREATE_IF_NEEDED",
+            )
+        return (
+            pcoll
+            | "DeadLetterToJson" >> beam.Map(json.dumps)
+            | "WriteDeadLetterGcs" >> beam.io.WriteToText(
+                file_path_prefix=f"{self.gcs_path.rstrip('/')}/dead_letter", file_name_suffix=".jsonl"
+            )
+        )
+
+
+class WriteToBigQueryParquet(beam.PTransform):
+    """Escribe los registros (dicts de model_dump) como parquet en el temp location, con el schema
+    de arrow del modelo, y los carga en BigQuery con un unico load job."""
+
+    def __init__(self, model, project: str, temp_location: str, codec: str = "snappy"):
+        super().__init__()
+        self.model = model
+        self.project = project
+        self.temp_location = temp_location
+        self.codec = codec
+
+    def expand(self, pcoll):
+        model = self.model
+        prefix = f"{self.temp_location.rstrip('/')}/parquet/{model.__tablename__}/{uuid.uuid4().hex}/part"
+        return (
+            pcoll
+            | "ToArrowRow" >> beam.Map(model.to_arrow_row)
+            | "WriteParquet" >> WriteToParquet(
+                file_path_prefix=prefix,
+                schema=model.arrow_schema(),
+                codec=self.codec,
+                file_name_suffix=".parquet",
+            )
+            | "CollectFiles" >> beam.combiners.ToList()
+            | "LoadJob" >> beam.ParDo(
+                LoadParquetToBigQueryDoFn(
+                    project=self.project,
+                    dataset=model.__dataset__,
+                    table=model.__tablename__,
+                    schema=model.bigquery_schema(exclude=["default"]),
+                    write_disposition=model.__write_disposition__,
+                    create_disposition=model.__create_disposition__,
+                )
+            )
+        )
+
+
+class WriteModelToBigQuery(beam.PTransform):
+    """Escribe los registros en la tabla del modelo con el metodo definido en __write_method__:
+    FILE_LOADS, PARQUET_LOADS o STORAGE_WRITE_API (exactly-once o at-least-once segun
+    __write_semantics__). Con local_sink los registros se escriben como JSON lines en ese path
+    en lugar de BigQuery, para probar el pipeline con el DirectRunner; con STORAGE_WRITE_API se
+    escriben ya convertidos con to_storage_write_row y se registran las opciones de escritura."""
+
+    def __init__(self, model, project: str, temp_location: str, local_sink: str | None = None):
+        super().__init__()
+        self.model = model
+        self.project = project
+        self.temp_location = temp_location
+        self.local_sink = local_sink
+
+    def storage_write_options(self, streaming: bool) -> dict:
+        """Opciones de WriteToBigQuery para STORAGE_WRITE_API. El auto sharding, la cantidad de
+        streams y triggering_frequency solo aplican a pipelines streaming: en batch se ignoran
+        (con un warning si el modelo los define)."""
+        model = self.model
+        options = dict(use_at_least_once=model.__write_semantics__ == "AT_LEAST_ONCE")
+        if not streaming:
+            if model.__storage_write_streams__ or model.__triggering_frequency__:
+                logging.warning(
+                    f"{model.__name__}: __storage_write_streams__ y __triggering_frequency__ solo aplican "
+                    "en streaming, se ignoran en batch"
+                )
+            return options
+
+        if model.__storage_write_streams__:
+            options["num_storage_api_streams"] = model.__storage_write_streams__
+        else:
+            options["with_auto_sharding"] = True
+        if model.__triggering_frequency__:
+            options["triggering_frequency"] = model.__triggering_frequency__
+        return options
+
+    def expand(self, pcoll):
+        model = self.model
+        storage_write = model.__write_method__ == "STORAGE_WRITE_API"
+        if storage_write:
+            streaming = pcoll.pipeline.options.view_as(StandardOptions).streaming
+            storage_write_options = self.storage_write_options(streaming)
+            pcoll = pcoll | "ToStorageWriteRow" >> beam.Map(model.to_storage_write_row)
+
+        if self.local_sink:
+            if storage_write:
+                logging.info(f"{model.__name__}: opciones de STORAGE_WRITE_API {storage_write_options}")
+            return (
+                pcoll
+                | "ToJson" >> beam.Map(lambda row: json.dumps(row, default=str))
+                | "WriteLocalSink" >> beam.io.WriteToText(
+                    file_path_prefix=f"{self.local_sink.rstrip('/')}/{model.__dataset__}.{model.__tablename__}",
+                    file_name_suffix=".jsonl",
+                )
+            )
+
+        if model.__write_method__ == "PARQUET_LOADS":
+            return pcoll | "WriteToBigQueryParquet" >> WriteToBigQueryParquet(
+                model=model, project=self.project, temp_location=self.temp_location
+            )
+
+        common = dict(
+            project=self.project,
+            dataset=model.__dataset__,
+            table=model.__tablename__,
+            write_disposition=model.__write_disposition__,
+            create_disposition=model.__create_disposition__,
+            schema=model.bigquery_schema(exclude=["default"]),
+        )
+
+        if storage_write:
+            return pcoll | "WriteToBigQueryStorageWrite" >> beam.io.WriteToBigQuery(
+                method="STORAGE_WRITE_API", **storage_write_options, **common
+            )
+
+        return pcoll | "WriteToBigQueryFileLoads" >> beam.io.WriteToBigQuery(
+            method="FILE_LOADS", custom_gcs_temp_location=self.temp_location, **common
+        )
+
+
+class JsonRowSink(fileio.TextSink):
+    """Sink de fileio.WriteToFiles para elementos (destination, row): escribe el row como JSON line."""
+
+    def write(self, element: tuple):
+        super().write(json.dumps(element[1], default=str))
+
+
+class WriteFanOutToBigQuery(beam.PTransform):
+    """Escribe (destination, row) de varios modelos en un mismo job: los registros se escriben como
+    JSON lines en un directorio por tabla (dynamic destinations de fileio.WriteToFiles) y cada tabla
+    se carga con un unico load job, con el schema y las dispositions de su modelo. El fan-out carga
+    siempre por load jobs, sin importar el __write_method__ de cada modelo. Con local_sink los
+    registros de cada tabla se escriben con WriteToText en ese path (como WriteModelToBigQuery) y no
+    se carga BigQuery."""
+
+    def __init__(self, models: list, project: str, temp_location: str, local_sink: str | None = None):
+        super().__init__()
+        self.models = models
+        self.project = project
+        self.temp_location = temp_location
+        self.local_sink = local_sink
+
+    def expand(self, pcoll):
+        if self.local_sink:
+            return self.write_local_sink(pcoll)
+
+        files = pcoll | "WriteFilesPerTable" >> fileio.WriteToFiles(
+            path=f"{self.temp_location.rstrip('/')}/fan_out/{uuid.uuid4().hex}",
+            destination=lambda element: element[0],
+            sink=lambda destination: JsonRowSink(),
+            file_naming=fileio.destination_prefix_naming(suffix=".jsonl"),
+        )
+
+        destinations = {
+            table_destination(model): dict(
+                schema=model.bigquery_schema(exclude=["default"]),
+                write_disposition=model.__write_disposition__,
+                create_disposition=model.__create_disposition__,
+            )
+            for model in self.models
+        }
+        return (
+            files
+            | "FilesPerTable" >> beam.Map(lambda result: (result.destination, result.file_name))
+            | "GroupFilesPerTable" >> beam.GroupByKey()
+            | "LoadJobs" >> beam.ParDo(LoadFilesToBigQueryDoFn(project=self.project, destinations=destinations))
+        )
+
+    def write_local_sink(self, pcoll):
+        """Un WriteToText por tabla: a diferencia de fileio.WriteToFiles, WriteToText crea el
+        directorio local si no existe (con WriteToFiles los archivos quedaban en el directorio
+        temporal)."""
+        written = []
+        for destination in sorted({table_destination(model) for model in self.models}):
+            written.append(
+                pcoll
+                | f"Filter{destination}" >> beam.Filter(lambda element, destination=destination: element[0] == destination)
+                | f"ToJson{destination}" >> beam.Map(lambda element: json.dumps(element[1], default=str))
+                | f"WriteLocalSink{destination}" >> beam.io.WriteToText(
+                    file_path_prefix=f"{self.local_sink.rstrip('/')}/{destination}", file_name_suffix=".jsonl"
+                )
+            )
+        return tuple(written) | "FlattenLocalSink" >> beam.Flatten()
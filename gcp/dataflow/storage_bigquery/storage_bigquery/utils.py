@@ -0,0 +1,16 @@
+from apache_beam.io.filesystems import FileSystems
+
+
+def expand_input_files(file_pattern: str | None = None, manifest: str | None = None) -> list:
+    """Devuelve los archivos a cargar: los que coinciden con el glob file_pattern y/o los listados
+    en el manifest (un path o glob por linea, se ignoran las lineas vacias y las que empiezan con #)."""
+    patterns = [file_pattern] if file_pattern else []
+    if manifest:
+        with FileSystems.open(manifest) as fmanifest:
+            lines = fmanifest.read().decode("utf-8").splitlines()
+        patterns.extend(line.strip() for line in lines if line.strip() and not line.strip().startswith("#"))
+
+    files = []
+    for match in FileSystems.match(patterns):
+        files.extend(metadata.path for metadata in match.metadata_list)
+    return sorted(set(files))
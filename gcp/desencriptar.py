@@ -1,14 +1,29 @@
+from __future__ import annotations
+
 import os
 import json
+from functools import lru_cache
+from typing import TYPE_CHECKING
 from datetime import datetime
-from cryptography.fernet import Fernet
-from google.cloud import storage
-from google.cloud import logging
+
+from key_provider import KeyProvider, as_fernet
+from idempotency import build_state_store, event_key
+from framed_format import read_frames, read_header
+from stream_compression import decompress_blocks
+
+# google.cloud.* se importa recien cuando se usa para acelerar el cold start
+if TYPE_CHECKING:
+    from google.cloud import storage
 
 # Variables de entorno
 PROJECT_ID = os.environ.get("PROJECT_ID")
 BUCKET_DESENCRIPTADOS = os.environ.get("BUCKET_DESENCRIPTADOS")
 SECRET_KEY = os.environ.get("SECRET_KEY")
+SECRET_KEY_NAME = os.environ.get("SECRET_KEY_NAME") # opcional: projects/.../secrets/.../versions/latest
+KEY_TTL = int(os.environ.get("KEY_TTL", 3600))
+IDEMPOTENCY_STORE = os.environ.get("IDEMPOTENCY_STORE", "none") # none | sqlite | datastore
+IDEMPOTENCY_SQLITE_PATH = os.environ.get("IDEMPOTENCY_SQLITE_PATH", "/tmp/desencriptar_events.db")
+IDEMPOTENCY_LEASE = int(os.environ.get("IDEMPOTENCY_LEASE", 540)) # timeout de la Cloud Function
 
 # Constantes
 START_DATETIME = datetime.now()
@@ -16,9 +31,26 @@ START_DATE = START_DATETIME.strftime("%Y%m%d") # -%H%M%S
 PROCESO_ID = ""
 name = ""
 
-# Clientes de GCP
-storage_client = storage.Client()
-logging_client = logging.Client()
+# Clientes de GCP: se crean en el primer uso y se reutilizan en las invocaciones siguientes
+@lru_cache(maxsize=None)
+def get_storage_client() -> storage.Client:
+    from google.cloud import storage
+    return storage.Client()
+
+@lru_cache(maxsize=None)
+def get_state_store():
+    return build_state_store(IDEMPOTENCY_STORE, sqlite_path=IDEMPOTENCY_SQLITE_PATH, project=PROJECT_ID)
+
+# Obtiene la key: desde secret manager si se define SECRET_KEY_NAME, sino desde SECRET_KEY
+def get_secret_key() -> str:
+    if not SECRET_KEY_NAME:
+        return SECRET_KEY
+    from google.cloud import secretmanager
+    response_secret = secretmanager.SecretManagerServiceClient().access_secret_version(name=SECRET_KEY_NAME)
+    return response_secret.payload.data.decode("UTF-8")
+
+# Cache de la key y del Fernet, compartido entre eventos de una misma instancia
+key_provider = KeyProvider(get_secret_key, ttl=KEY_TTL)
 
 # PRINT_STRUCTURE_LOGS
 def print_struct_logs(message, severity="INFO"):
@@ -43,7 +75,7 @@ def print_struct_logs(message, severity="INFO"):
 
 # Desencripta el archivo
 def decrypt_data(encrypted_blob: storage.Blob, decrypted_blob: storage.Blob, key) -> storage.Blob:
-    f = Fernet(key)
+    f = as_fernet(key)
     with encrypted_blob.open(mode="rb") as finput:
         with decrypted_blob.open(mode="wb") as foutput:
             foutput.write(f.decrypt(finput.read()))
@@ -51,6 +83,25 @@ def decrypt_data(encrypted_blob: storage.Blob, decrypted_blob: storage.Blob, key
     decrypted_blob.reload()
     return decrypted_blob
 
+# Desencripta el archivo frame a frame (gcp/framed_format.py). Si el archivo es un unico token (formato legacy)
+# se desencripta completo como en decrypt_data.
+def decrypt_data_stream(encrypted_blob: storage.Blob, decrypted_blob: storage.Blob, key, compression: str = "none") -> storage.Blob:
+    f = as_fernet(key)
+    with encrypted_blob.open(mode="rb") as finput:
+        header, is_framed = read_header(finput)
+        with decrypted_blob.open(mode="wb") as foutput:
+            if not is_framed:
+                foutput.write(f.decrypt(header + finput.read()))
+            else:
+                blocks = read_frames(finput, f)
+                if compression != "none":
+                    blocks = decompress_blocks(blocks, compression)
+                for block in blocks:
+                    foutput.write(block)
+
+    decrypted_blob.reload()
+    return decrypted_blob
+
 def main(event, context):
     global PROCESO_ID
     global name
@@ -58,29 +109,59 @@ def main(event, context):
     blob_name = event["name"]
     bucket = event["bucket"]
     
-    blob = storage_client.get_bucket(bucket).get_blob(blob_name)
+    # Solo se desencriptan los objetos en data/ (tmp/ contiene las partes de uploads compuestos)
+    if not blob_name.startswith("data/"):
+        return 1
+    
+    storage_client = get_storage_client()
+    blob = storage_client.bucket(bucket).get_blob(blob_name)
     PROCESO_ID = blob.metadata["proceso_id"]
     name = os.path.basename(blob_name).split(".")[0].lower()
     
+    # Los objetos re-encriptados por rotacion de keys tienen el mismo contenido, no se desencriptan de nuevo
+    if blob.metadata.get("rotated_at"):
+        print_struct_logs("El archivo fue re-encriptado por rotacion de keys, no se desencripta.", severity="INFO")
+        return 1
+    
     print_struct_logs("Se procede a crear un blob object para almacenar el contenido encriptado.", severity="INFO")
     try:
         output_blob_name = "data/" + START_DATE + "/" + os.path.basename(blob_name).split(".")[0] + ".txt"
-        output_bucket = storage_client.get_bucket(BUCKET_DESENCRIPTADOS)
+        output_bucket = storage_client.bucket(BUCKET_DESENCRIPTADOS)
+        existing_blob = output_bucket.get_blob(output_blob_name)
         output_blob = output_bucket.blob(output_blob_name)
     except Exception as error:
         error = f"Fallo (creacion del blob object): {str(error)}"
         print_struct_logs(error, severity="ERROR")
         return -1
     
+    # Evento duplicado: el output ya existe y proviene de la misma generation del blob encriptado
+    generation = str(blob.generation)
+    if existing_blob is not None and (existing_blob.metadata or {}).get("source_generation") == generation:
+        print_struct_logs(f"El archivo ya fue desencriptado (generation {generation}), se omite.", severity="INFO")
+        return 1
+    
+    # Evento duplicado en curso en otra instancia
+    state_store = get_state_store()
+    idempotency_key = event_key(bucket, blob_name, generation, PROCESO_ID)
+    if state_store is not None and not state_store.claim(idempotency_key, IDEMPOTENCY_LEASE):
+        print_struct_logs(f"El evento {idempotency_key} ya fue procesado o esta en curso, se omite.", severity="INFO")
+        return 1
+    
     print_struct_logs("Se procede a desencriptar el archivo", severity="INFO")
     try:
-        output_blob = decrypt_data(blob, output_blob, SECRET_KEY)
-        output_blob.metadata = blob.metadata
+        compression = blob.metadata.get("compression", "none")
+        output_blob = decrypt_data_stream(blob, output_blob, key_provider.get_fernet(), compression=compression)
+        output_blob.metadata = {**blob.metadata, "source_bucket": bucket, "source_name": blob_name, "source_generation": generation}
         output_blob.patch()
     except Exception as error:
+        if state_store is not None:
+            state_store.release(idempotency_key)
         error = f"Exception mientras se desencriptaba el archivo: {str(error)}"
         print_struct_logs(error, severity="ERROR")
         return -1
+    
+    if state_store is not None:
+        state_store.mark_done(idempotency_key)
 
     duration = round((datetime.now() - START_DATETIME).total_seconds())
     print_struct_logs(f"Proceso terminado con exito ({duration}s)", severity="INFO")
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import struct
+from typing import TYPE_CHECKING, BinaryIO, Iterator
+
+# cryptography se importa recien cuando se usa (solo se necesita el tipo aca)
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet, MultiFernet
+
+# Formato framed, compartido por encriptar.py, desencriptar.py y reencriptar.py:
+# MAGIC + VERSION + [largo (4 bytes) + token fernet] por cada frame.
+# Cada token encripta FRAME_HEADER (numero de frame + flag de ultimo frame) + datos,
+# de modo que reordenar o truncar frames se detecta al desencriptar.
+FRAMED_MAGIC = b"FRNT"
+FRAMED_VERSION = 1
+FRAMED_PREFIX = FRAMED_MAGIC + bytes([FRAMED_VERSION])
+FRAME_LENGTH = struct.Struct(">I")
+FRAME_HEADER = struct.Struct(">Q?")
+MAX_TOKEN_SIZE = 256 * 1024 * 1024
+
+
+# Lee el header del stream. Devuelve (header, is_framed): si no es framed (formato legacy) el
+# header son los primeros bytes del token y el caller debe concatenarlos con el resto.
+def read_header(finput: BinaryIO) -> tuple[bytes, bool]:
+    header = finput.read(len(FRAMED_PREFIX))
+    if header[:len(FRAMED_MAGIC)] != FRAMED_MAGIC:
+        return header, False
+    if header[-1] != FRAMED_VERSION:
+        raise ValueError(f"Version de formato framed no soportada: {header[-1]}")
+    return header, True
+
+
+# Lee el archivo en bloques de tamaño fijo. Indica si el bloque es el ultimo.
+def iter_chunks(finput: BinaryIO, frame_size: int) -> Iterator[tuple[bytes, bool]]:
+    block = finput.read(frame_size)
+    while True:
+        next_block = finput.read(frame_size)
+        is_last = not next_block
+        yield block, is_last
+        if is_last:
+            return
+        block = next_block
+
+
+def write_token(foutput: BinaryIO, token: bytes) -> None:
+    foutput.write(FRAME_LENGTH.pack(len(token)))
+    foutput.write(token)
+
+
+# Escribe el contenido de finput en foutput usando el formato framed (header incluido).
+def write_frames(finput: BinaryIO, foutput: BinaryIO, f: Fernet | MultiFernet, frame_size: int) -> int:
+    foutput.write(FRAMED_PREFIX)
+    frames = 0
+    for index, (block, is_last) in enumerate(iter_chunks(finput, frame_size)):
+        write_token(foutput, f.encrypt(FRAME_HEADER.pack(index, is_last) + block))
+        frames += 1
+    return frames
+
+
+# Devuelve los tokens de finput (ya consumido el header) sin desencriptarlos, hasta el fin del stream.
+def iter_tokens(finput: BinaryIO) -> Iterator[bytes]:
+    while True:
+        raw_length = finput.read(FRAME_LENGTH.size)
+        if not raw_length:
+            return
+        if len(raw_length) != FRAME_LENGTH.size:
+            raise ValueError("Stream truncado: largo de frame incompleto")
+        (length,) = FRAME_LENGTH.unpack(raw_length)
+        if length > MAX_TOKEN_SIZE:
+            raise ValueError(f"Frame invalido de {length} bytes")
+        token = finput.read(length)
+        if len(token) != length:
+            raise ValueError("Stream truncado: frame incompleto")
+        yield token
+
+
+# Lee los frames de finput (ya consumido el header) y devuelve los bloques desencriptados en orden.
+def read_frames(finput: BinaryIO, f: Fernet | MultiFernet) -> Iterator[bytes]:
+    expected_index = 0
+    for token in iter_tokens(finput):
+        data = f.decrypt(token)
+        index, is_last = FRAME_HEADER.unpack_from(data)
+        if index != expected_index:
+            raise ValueError(f"Frame fuera de orden: se esperaba {expected_index} y se obtuvo {index}")
+        yield data[FRAME_HEADER.size:]
+
+        if is_last:
+            return
+        expected_index += 1
+    raise ValueError("Stream truncado: falta el ultimo frame")
+
+
+
+# Re-encripta cada frame (ya consumido el header) con la key mas nueva sin desencriptar el archivo completo.
+# rotate conserva el timestamp del token y el header del frame (indice + ultimo frame).
+def rotate_frames(finput: BinaryIO, foutput: BinaryIO, f: MultiFernet) -> int:
+    frames = 0
+    for token in iter_tokens(finput):
+        write_token(foutput, f.rotate(token))
+        frames += 1
+    return frames
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import time
+import sqlite3
+import threading
+from typing import Optional
+
+# Estados de un evento en el state store
+PROCESSING = "processing"
+DONE = "done"
+
+
+# Clave de idempotencia de un evento de GCS: cada generation de un objeto se procesa una sola vez
+def event_key(bucket: str, name: str, generation: str, proceso_id: str) -> str:
+    return f"{bucket}/{name}#{generation}#{proceso_id}"
+
+
+# Interfaz del state store. claim es atomico: solo un worker obtiene el evento,
+# salvo que el lease del anterior haya vencido (por ejemplo, si murio a mitad de camino).
+class StateStore:
+    def claim(self, key: str, lease_seconds: float) -> bool:
+        raise NotImplementedError
+
+    def mark_done(self, key: str) -> None:
+        raise NotImplementedError
+
+    def release(self, key: str) -> None:
+        raise NotImplementedError
+
+
+# State store local en SQLite, para tests y ejecuciones locales
+class SqliteStateStore(StateStore):
+    def __init__(self, path: str = ":memory:"):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS events (key TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def claim(self, key: str, lease_seconds: float) -> bool:
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute("SELECT state, updated_at FROM events WHERE key = ?", (key,)).fetchone()
+                if row is not None and (row[0] == DONE or now - row[1] < lease_seconds):
+                    self.connection.execute("ROLLBACK")
+                    return False
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO events (key, state, updated_at) VALUES (?, ?, ?)", (key, PROCESSING, now)
+                )
+                self.connection.execute("COMMIT")
+                return True
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def mark_done(self, key: str) -> None:
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO events (key, state, updated_at) VALUES (?, ?, ?)", (key, DONE, time.time())
+            )
+
+    def release(self, key: str) -> None:
+        with self.lock:
+            self.connection.execute("DELETE FROM events WHERE key = ? AND state = ?", (key, PROCESSING))
+
+
+# State store en Datastore (Firestore en modo Datastore), compartido entre instancias en produccion
+class DatastoreStateStore(StateStore):
+    def __init__(self, kind: str = "desencriptar_events", project: Optional[str] = None):
+        from google.cloud import datastore
+
+        self.kind = kind
+        self.client = datastore.Client(project=project)
+
+    def claim(self, key: str, lease_seconds: float) -> bool:
+        from google.cloud import datastore
+
+        now = time.time()
+        entity_key = self.client.key(self.kind, key)
+        with self.client.transaction():
+            entity = self.client.get(entity_key)
+            if entity is not None and (entity["state"] == DONE or now - entity["updated_at"] < lease_seconds):
+                return False
+            entity = datastore.Entity(key=entity_key)
+            entity.update({"state": PROCESSING, "updated_at": now})
+            self.client.put(entity)
+        return True
+
+    def mark_done(self, key: str) -> None:
+        from google.cloud import datastore
+
+        entity = datastore.Entity(key=self.client.key(self.kind, key))
+        entity.update({"state": DONE, "updated_at": time.time()})
+        self.client.put(entity)
+
+    def release(self, key: str) -> None:
+        self.client.delete(self.client.key(self.kind, key))
+
+
+# Construye el state store indicado: none | sqlite | datastore
+def build_state_store(store: str, sqlite_path: str = ":memory:", project: Optional[str] = None) -> Optional[StateStore]:
+    if store == "none":
+        return None
+    if store == "sqlite":
+        return SqliteStateStore(sqlite_path)
+    if store == "datastore":
+        return DatastoreStateStore(project=project)
+    raise ValueError(f"State store no soportado: {store}")
@@ -0,0 +1,59 @@
+import io
+import time
+import argparse
+
+import utils
+from bench_format_records import build_line, build_model
+
+# Compara filas/s de los motores de parseo sobre un mismo archivo en memoria: format_record +
+# model_dump (linea por linea), format_records (batches de lineas), read_csv_batches (modulo csv)
+# y read_arrow_batches (lector CSV de pyarrow).
+# Uso: python bench_csv_engines.py [--rows 200000] [--batch-size 10000]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    model = build_model()
+    model.__header__ = False
+    text = "\n".join([build_line()] * args.rows) + "\n"
+
+    def format_record_engine() -> list:
+        return [utils.format_record(line, ",", model).model_dump() for line in text.splitlines()]
+
+    def format_records_engine() -> list:
+        lines = text.splitlines()
+        rows = []
+        for index in range(0, len(lines), args.batch_size):
+            rows.extend(utils.format_records(lines[index:index + args.batch_size], model))
+        return rows
+
+    def csv_engine() -> list:
+        return [row for batch in utils.read_csv_batches(io.StringIO(text, newline=""), model, args.batch_size) for row in batch]
+
+    def arrow_engine() -> list:
+        return [row for batch in utils.read_arrow_batches(io.BytesIO(text.encode()), model) for row in batch]
+
+    engines = {
+        "format_record + model_dump": format_record_engine,
+        f"format_records (batch {args.batch_size})": format_records_engine,
+        f"read_csv_batches (batch {args.batch_size})": csv_engine,
+        "read_arrow_batches": arrow_engine,
+    }
+    expected = None
+    baseline = None
+    for name, engine in engines.items():
+        start = time.perf_counter()
+        rows = engine()
+        seconds = time.perf_counter() - start
+        if expected is None:
+            expected, baseline = rows, seconds
+        assert rows == expected, name
+        print(f"{name}: {args.rows / seconds:,.0f} filas/s ({baseline / seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
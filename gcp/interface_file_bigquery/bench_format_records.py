@@ -0,0 +1,54 @@
+import time
+import argparse
+import datetime
+from typing import Optional
+
+from pydantic import create_model
+
+from pydantic_base_model_bigquery import BigqueryBase
+import utils
+
+# Compara filas/s de format_record + model_dump (una fila por vez) contra format_records (batch).
+# Uso: python bench_format_records.py [--rows 200000] [--batch-size 10000]
+
+
+def build_model() -> type:
+    fields = {f"texto_{i}": (Optional[str], None) for i in range(10)}
+    fields.update({f"entero_{i}": (Optional[int], None) for i in range(5)})
+    fields.update({f"decimal_{i}": (Optional[float], None) for i in range(4)})
+    fields["fecha_carga"] = (Optional[datetime.datetime], None)
+    return create_model("FctBenchModel", __base__=BigqueryBase, __tablename__=(str, "fct_bench"), **fields)
+
+
+def build_line() -> str:
+    values = [f"texto{i}" for i in range(10)] + [str(i) for i in range(5)] + ["1.5"] * 4
+    return ",".join(values + ["2020-01-01 10:00:00 UTC"])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    model = build_model()
+    lines = [build_line()] * args.rows
+
+    start = time.perf_counter()
+    per_row = [utils.format_record(line, ",", model).model_dump() for line in lines]
+    per_row_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = []
+    for index in range(0, len(lines), args.batch_size):
+        batched.extend(utils.format_records(lines[index:index + args.batch_size], model))
+    batched_seconds = time.perf_counter() - start
+
+    assert per_row == batched
+    print(f"format_record + model_dump: {args.rows / per_row_seconds:,.0f} filas/s")
+    print(f"format_records (batch {args.batch_size}): {args.rows / batched_seconds:,.0f} filas/s")
+    print(f"speedup: {per_row_seconds / batched_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
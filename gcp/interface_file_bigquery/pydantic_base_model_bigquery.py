@@ -1,5 +1,9 @@
+import copy
 import datetime
-from typing import Any, Sequence, Tuple, get_args
+import decimal
+import json
+from types import MappingProxyType
+from typing import Any, Mapping, Sequence, Tuple, get_args
 
 from pydantic import BaseModel, ValidationInfo, field_validator
 from pydantic.fields import FieldInfo
@@ -17,22 +21,131 @@ PYTHON_TYPES_TO_BIG_QUERY = {
     Sequence: "RECORD",
 }
 
+# NUMERIC de BigQuery: precision 38, escala 9
+NUMERIC_PRECISION = 38
+NUMERIC_SCALE = 9
+
+
+def big_query_to_arrow_type(dtype: str) -> Any:
+    import pyarrow as pa
+
+    return {
+        "STRING": pa.string(),
+        "INT64": pa.int64(),
+        "NUMERIC": pa.decimal128(NUMERIC_PRECISION, NUMERIC_SCALE),
+        "BOOL": pa.bool_(),
+        "JSON": pa.string(),  # parquet no tiene tipo JSON, BigQuery lo carga desde string
+        "DATE": pa.date32(),
+        "DATETIME": pa.timestamp("us"),  # sin timezone -> DATETIME
+        "TIME": pa.time64("us"),
+        "RECORD": pa.string(),
+    }.get(dtype, pa.string())
+
+
+def _to_numeric(value: Any) -> Any:
+    if isinstance(value, float):
+        return decimal.Decimal(str(round(value, NUMERIC_SCALE)))
+    return value
+
+
+def _to_json(value: Any) -> Any:
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, default=str)
+
+
+def _to_isoformat(value: Any) -> Any:
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+# Conversion de los valores de model_dump a los tipos del schema de arrow
+ARROW_CONVERTERS = {
+    "NUMERIC": _to_numeric,
+    "JSON": _to_json,
+    "RECORD": _to_json,
+}
+
+# Conversion de los valores de model_dump a los tipos del Row de beam para STORAGE_WRITE_API:
+# DATE, DATETIME, TIME y JSON como string y NUMERIC como Decimal
+STORAGE_WRITE_CONVERTERS = {
+    **ARROW_CONVERTERS,
+    "DATE": _to_isoformat,
+    "DATETIME": _to_isoformat,
+    "TIME": _to_isoformat,
+}
+
+
+def _convert_row(row: dict, converters: Tuple) -> dict:
+    if not converters:
+        return row
+    row = dict(row)
+    for field, converter in converters:
+        if field in row:
+            row[field] = converter(row[field])
+    return row
+
 
 class BigqueryBase(BaseModel):
     __tablename__: str
     __dataset__: str = "raw"
     __delimiter__: str = ","
     __header__: bool = True
+    __quotechar__: str | None = None  # '"' para respetar campos entre comillas
     __write_disposition__: str = "WRITE_TRUNCATE"  # WRITE_APPEND
     __create_disposition__: str = "CREATE_IF_NEEDED"  # CREATE_NEVER
+    __write_method__: str = "FILE_LOADS"  # PARQUET_LOADS | STORAGE_WRITE_API
+    # Solo para STORAGE_WRITE_API
+    __write_semantics__: str = "EXACTLY_ONCE"  # AT_LEAST_ONCE
+    __storage_write_streams__: int = 0  # 0 = auto sharding (solo en streaming)
+    __triggering_frequency__: int | None = None  # segundos entre commits (solo en streaming)
+
+    # Precalculados por modelo en __pydantic_init_subclass__
+    __bigquery_fields__: Mapping[str, Tuple] = MappingProxyType({})
+    __datetime_fields__: frozenset = frozenset()
+    __bigquery_schema_cache__: dict = {}
+    __arrow_converters__: Tuple = ()
+    __storage_write_converters__: Tuple = ()
+
+    @classmethod
+    def __pydantic_init_subclass__(cls, **kwargs: Any) -> None:
+        super().__pydantic_init_subclass__(**kwargs)
+
+        # Tabla campo -> (dtype, mode, default, description), calculada una unica vez por modelo
+        cls.__bigquery_fields__ = MappingProxyType(
+            {field: cls.parse_field_info(field_info) for field, field_info in cls.model_fields.items()}
+        )
+        cls.__datetime_fields__ = frozenset(
+            field for field, (dtype, _, _, _) in cls.__bigquery_fields__.items() if dtype == "DATETIME"
+        )
+        cls.__bigquery_schema_cache__ = {}
+        cls.__arrow_converters__ = tuple(
+            (field, ARROW_CONVERTERS[dtype])
+            for field, (dtype, _, _, _) in cls.__bigquery_fields__.items()
+            if dtype in ARROW_CONVERTERS
+        )
+        cls.__storage_write_converters__ = tuple(
+            (field, STORAGE_WRITE_CONVERTERS[dtype])
+            for field, (dtype, _, _, _) in cls.__bigquery_fields__.items()
+            if dtype in STORAGE_WRITE_CONVERTERS
+        )
 
     @classmethod
     def bigquery_schema(cls, exclude: list = []) -> dict:
+        cache_key = frozenset(exclude)
+        if cache_key not in cls.__bigquery_schema_cache__:
+            cls.__bigquery_schema_cache__[cache_key] = cls._build_bigquery_schema(exclude)
+        # Copia para que el llamador no modifique el cache
+        return copy.deepcopy(cls.__bigquery_schema_cache__[cache_key])
+
+    @classmethod
+    def _build_bigquery_schema(cls, exclude: list) -> dict:
         fields = cls.model_fields
         schema = []
         for field, field_info in fields.items():
             schema_field = {}
-            dtype, mode, default, description = cls.parse_field_info(field_info)
+            dtype, mode, default, description = cls.__bigquery_fields__[field]
 
             # campos obligatorios
             schema_field["name"] = field
@@ -52,6 +165,28 @@ class BigqueryBase(BaseModel):
 
         return dict(fields=schema)
 
+    @classmethod
+    def arrow_schema(cls) -> Any:
+        import pyarrow as pa
+
+        return pa.schema(
+            [
+                pa.field(field, big_query_to_arrow_type(dtype), nullable=mode != "REQUIRED")
+                for field, (dtype, mode, _, _) in cls.__bigquery_fields__.items()
+            ]
+        )
+
+    @classmethod
+    def to_arrow_row(cls, row: dict) -> dict:
+        """Adapta un registro de model_dump al schema de arrow (NUMERIC a Decimal, JSON a string)."""
+        return _convert_row(row, cls.__arrow_converters__)
+
+    @classmethod
+    def to_storage_write_row(cls, row: dict) -> dict:
+        """Adapta un registro de model_dump al Row de STORAGE_WRITE_API (DATE/DATETIME/TIME y JSON a
+        string, NUMERIC a Decimal)."""
+        return _convert_row(row, cls.__storage_write_converters__)
+
     @classmethod
     def parse_field_info(cls, field_info: FieldInfo) -> Tuple:
         field_annotation = field_info.annotation  # int - str - Union[str, None] - etc.
@@ -74,11 +209,11 @@ class BigqueryBase(BaseModel):
 
         return dtype, mode, default, description
 
+    # Se declara para "*" porque la base no conoce los campos del modelo; para los campos que no
+    # son DATETIME el costo es solo la busqueda en el frozenset __datetime_fields__.
     @field_validator("*", mode="before")
     @classmethod
     def remove_utc_from_datetime(cls, value: Any, info: ValidationInfo) -> Any:
-        field_info = cls.model_fields[info.field_name]
-        dtype, _, _, _ = cls.parse_field_info(field_info)
-        if dtype == "DATETIME" and "UTC" in value:
+        if info.field_name in cls.__datetime_fields__ and isinstance(value, str) and "UTC" in value:
             return value.split("UTC")[0].strip()
         return value
\ No newline at end of file
@@ -1,10 +1,11 @@
+import csv
 import os
-from typing import Any
+import itertools
+from functools import lru_cache
+from typing import Any, Callable, Iterable, Iterator, TextIO, get_args
 
-from pydantic import BaseModel
-
-from dim_models import raw as dim_raw
-from fact_models import raw as fact_raw
+from pydantic import BaseModel, BeforeValidator, ConfigDict, TypeAdapter
+from typing_extensions import Annotated, NotRequired, Required, TypedDict
 
 
 def construct_model_name(file: str) -> str:
@@ -14,6 +15,10 @@ def construct_model_name(file: str) -> str:
 
 
 def select_model(class_name: str) -> BaseModel:
+    # Los modulos de modelos se importan al resolver el modelo, asi el parser se puede usar sin ellos
+    from dim_models import raw as dim_raw
+    from fact_models import raw as fact_raw
+
     if (
         "fct" in class_name.lower()
         or "fact" in class_name.lower()
@@ -29,9 +34,292 @@ def select_model(class_name: str) -> BaseModel:
 
 
 def format_record(record: str, delimiter: str = ",", model: Any = None) -> list | BaseModel:
-    output = [element.strip() for element in record.split(delimiter)]
+    output = [element.strip() for element in next(iter(record_splitter(model, delimiter)([record])), [])]
     if model:
-        fields = list(model.model_fields.keys())
+        fields = model_field_names(model)
         data = {fields[k]: output[k] for k in range(len(output)) if output[k]}
         return model(**data)
-    return output
\ No newline at end of file
+    return output
+
+
+@lru_cache(maxsize=None)
+def model_field_names(model: Any) -> tuple:
+    return tuple(model.model_fields.keys())
+
+
+def _remove_utc(value: Any) -> Any:
+    if isinstance(value, str) and "UTC" in value:
+        return value.split("UTC")[0].strip()
+    return value
+
+
+# Validadores propios del modelo que el parser en bulk sabe reproducir
+_BULK_SUPPORTED_VALIDATORS = {"remove_utc_from_datetime"}
+
+# Opciones de model_config que el TypedDict reproduce (se le pasan como __pydantic_config__).
+# Con cualquier otra opcion (alias_generator, extra, validate_default, ...) se valida con el modelo.
+_BULK_SUPPORTED_CONFIG = {
+    "title",
+    "str_to_lower",
+    "str_to_upper",
+    "str_strip_whitespace",
+    "str_min_length",
+    "str_max_length",
+    "strict",
+    "coerce_numbers_to_str",
+    "arbitrary_types_allowed",
+}
+
+
+def _supports_bulk(model: Any) -> bool:
+    decorators = model.__pydantic_decorators__
+    return (
+        set(model.model_config) <= _BULK_SUPPORTED_CONFIG
+        and set(decorators.field_validators) <= _BULK_SUPPORTED_VALIDATORS
+        and not decorators.model_validators
+        and not decorators.field_serializers
+        and not decorators.model_serializers
+        and not decorators.computed_fields
+    )
+
+
+def _row_typed_dict(model: Any) -> type:
+    datetime_fields = getattr(model, "__datetime_fields__", frozenset())
+    annotations = {}
+    for field, field_info in model.model_fields.items():
+        annotation = Annotated[(field_info.annotation, *field_info.metadata)] if field_info.metadata else field_info.annotation
+        if field in datetime_fields:
+            annotation = Annotated[annotation, BeforeValidator(_remove_utc)]
+        annotations[field] = Required[annotation] if field_info.is_required() else NotRequired[annotation]
+    row_typed_dict = TypedDict(f"{model.__name__}Row", annotations)
+    row_typed_dict.__pydantic_config__ = ConfigDict(**model.model_config)
+    return row_typed_dict
+
+
+# Compila, una unica vez por modelo, un validador de dicts (campo -> valor en texto) a dicts validados.
+# Valida todo el batch con un TypeAdapter sobre list[TypedDict] equivalente al modelo, sin
+# construir un BaseModel por fila. Si el modelo tiene validadores que el TypedDict no
+# reproduce, se valida con el modelo y se usa model_dump (mismo resultado que format_record).
+@lru_cache(maxsize=None)
+def compile_row_validator(model: Any) -> Callable[[list], list]:
+    if not _supports_bulk(model):
+        adapter = TypeAdapter(list[model])
+
+        def validate_with_model(rows: list) -> list:
+            return [record.model_dump() for record in adapter.validate_python(rows)]
+
+        return validate_with_model
+
+    adapter = TypeAdapter(list[_row_typed_dict(model)])
+    # get_default copia los defaults mutables (igual que el modelo), asi las filas no comparten objetos
+    defaults = [
+        (field, field_info)
+        for field, field_info in model.model_fields.items()
+        if not field_info.is_required()
+    ]
+
+    def validate(rows: list) -> list:
+        validated = adapter.validate_python(rows)
+        for row in validated:
+            for field, field_info in defaults:
+                if field not in row:
+                    row[field] = field_info.get_default(call_default_factory=True)
+        return validated
+
+    return validate
+
+
+# Convierte las filas (listas de valores) en dicts por nombre de campo, sin los valores vacios
+def rows_to_dicts(rows: Iterable, model: Any) -> list:
+    fields = model_field_names(model)
+    n_fields = len(fields)
+    dicts = []
+    for values in rows:
+        if len(values) > n_fields:
+            raise ValueError(f"El registro tiene {len(values)} columnas y el modelo {model.__name__} {n_fields}")
+        dicts.append({field: value for field, value in zip(fields, map(str.strip, values)) if value})
+    return dicts
+
+
+# Funcion que separa las lineas en valores. Si el modelo define __quotechar__ se usa el modulo
+# csv, que respeta el delimitador y los saltos de linea dentro de los campos entre comillas.
+# Cada registro se lee por separado: una comilla sin cerrar falla solo ese registro en lugar
+# de unirse con los siguientes.
+@lru_cache(maxsize=None)
+def record_splitter(model: Any, delimiter: str = ",") -> Callable[[Iterable], Iterable]:
+    if model is not None and getattr(model, "__quotechar__", None):
+        dialect = dict(csv_dialect(model), delimiter=delimiter, strict=True)
+        return lambda records: (next(csv.reader((record,), **dialect), []) for record in records)
+    return lambda records: (record.split(delimiter) for record in records)
+
+
+# Parser de lineas a dicts validados para (modelo, delimitador), compilado una unica vez
+@lru_cache(maxsize=None)
+def compile_record_parser(model: Any, delimiter: str = ",") -> Callable[[list], list]:
+    validate = compile_row_validator(model)
+    split = record_splitter(model, delimiter)
+
+    def parse(records: list) -> list:
+        return validate(rows_to_dicts(split(records), model))
+
+    return parse
+
+
+def format_records(records: list, model: Any, delimiter: str = ",") -> list:
+    """Parsea y valida un batch de lineas y devuelve dicts (equivalente a format_record + model_dump)."""
+    return compile_record_parser(model, delimiter)(records)
+
+
+# Parametros del modulo csv segun el modelo. Sin __quotechar__ las comillas no tienen
+# significado especial (mismo comportamiento que split).
+def csv_dialect(model: Any) -> dict:
+    quotechar = getattr(model, "__quotechar__", None)
+    if quotechar:
+        return dict(delimiter=model.__delimiter__, quotechar=quotechar, quoting=csv.QUOTE_MINIMAL, doublequote=True)
+    return dict(delimiter=model.__delimiter__, quoting=csv.QUOTE_NONE)
+
+
+# Descarta las filas vacias o solo con espacios (csv.reader devuelve [] para una linea en blanco),
+# igual que el lector del pipeline
+def _non_blank(rows: Iterable) -> Iterator[list]:
+    return (values for values in rows if any(value.strip() for value in values))
+
+
+# Convierte las filas a dicts. Con errors, las filas con mas columnas que el modelo se agregan a
+# errors como (valores, error) en lugar de fallar el batch.
+def _rows_to_dicts(rows: Iterable, model: Any, errors: list | None) -> list:
+    if errors is None:
+        return rows_to_dicts(_non_blank(rows), model)
+    dicts = []
+    for values in _non_blank(rows):
+        try:
+            dicts.extend(rows_to_dicts([values], model))
+        except ValueError as error:
+            errors.append((values, error))
+    return dicts
+
+
+# Valida el batch completo. Si falla y se pasa errors, se revalida fila por fila: las filas validas
+# se devuelven y las invalidas se agregan a errors como (dict, error).
+def _validate_rows(validate: Callable[[list], list], rows: list, errors: list | None) -> list:
+    try:
+        return validate(rows)
+    except Exception:
+        if errors is None:
+            raise
+    validated = []
+    for row in rows:
+        try:
+            validated.extend(validate([row]))
+        except Exception as error:
+            errors.append((row, error))
+    return validated
+
+
+def parse_csv_records(records: Iterable, model: Any, errors: list | None = None) -> list:
+    """Parsea y valida lineas con el modulo csv (respeta campos entre comillas) y devuelve dicts.
+    Con errors (una lista) las filas invalidas se agregan ahi y no fallan el batch."""
+    rows = _rows_to_dicts(csv.reader(records, **csv_dialect(model)), model, errors)
+    return _validate_rows(compile_row_validator(model), rows, errors)
+
+
+def read_csv_batches(finput: TextIO, model: Any, batch_size: int = 10000, errors: list | None = None) -> Iterator[list]:
+    """Lee un archivo de texto completo con el modulo csv (en C) y devuelve batches de dicts validados.
+    Respeta __delimiter__, __header__ y __quotechar__ del modelo; los campos entre comillas pueden
+    contener el delimitador y saltos de linea. Con errors (una lista) las filas invalidas se agregan
+    ahi y no fallan el batch."""
+    reader = csv.reader(finput, **csv_dialect(model))
+    if model.__header__:
+        next(reader, None)
+    validate = compile_row_validator(model)
+    while batch := list(itertools.islice(reader, batch_size)):
+        yield _validate_rows(validate, _rows_to_dicts(batch, model, errors), errors)
+
+
+# Tipos de arrow a los que se castean las columnas antes de validar (el resto queda como string)
+def _arrow_types() -> dict:
+    import pyarrow as pa
+
+    return {"INT64": pa.int64(), "NUMERIC": pa.float64(), "BOOL": pa.bool_()}
+
+
+def _accepts_none(annotation: Any) -> bool:
+    return annotation is None or type(None) in get_args(annotation)
+
+
+def read_arrow_batches(
+    source: Any, model: Any, block_size: int = 16 * 1024 * 1024, errors: list | None = None
+) -> Iterator[list]:
+    """Lee el archivo con el lector CSV de pyarrow (por bloques) y devuelve batches de dicts validados.
+    Cada columna se limpia de espacios y se castea al tipo de BigQuery de forma vectorizada; si el
+    cast de una columna falla queda como string y pydantic informa las filas invalidas.
+    Las filas con menos columnas que el modelo (que format_record acepta) se parsean aparte con el
+    splitter del modelo; con errors (una lista) las filas invalidas se agregan ahi y no fallan el batch."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pyarrow import csv as pa_csv
+
+    fields = list(model_field_names(model))
+    quotechar = getattr(model, "__quotechar__", None)
+    short_rows = []
+
+    def handle_invalid_row(row) -> str:
+        if row.actual_columns < row.expected_columns:
+            short_rows.append(row.text)
+            return "skip"
+        if errors is None:
+            return "error"
+        errors.append((row.text, ValueError(f"El registro tiene {row.actual_columns} columnas y el modelo {model.__name__} {len(fields)}")))
+        return "skip"
+
+    reader = pa_csv.open_csv(
+        source,
+        read_options=pa_csv.ReadOptions(
+            column_names=fields, skip_rows=int(model.__header__), block_size=block_size
+        ),
+        parse_options=pa_csv.ParseOptions(
+            delimiter=model.__delimiter__,
+            quote_char=quotechar or False,
+            newlines_in_values=bool(quotechar),
+            invalid_row_handler=handle_invalid_row,
+        ),
+        convert_options=pa_csv.ConvertOptions(column_types={field: pa.string() for field in fields}),
+    )
+
+    bigquery_fields = getattr(model, "__bigquery_fields__", {})
+    arrow_types = _arrow_types()
+    validate = compile_row_validator(model)
+    split = record_splitter(model, model.__delimiter__)
+    drop_none_fields = [
+        field
+        for field, field_info in model.model_fields.items()
+        if field_info.is_required() or field_info.default is not None or not _accepts_none(field_info.annotation)
+    ]
+    for batch in reader:
+        columns = {}
+        for field in fields:
+            column = pc.utf8_trim_whitespace(batch.column(field))
+            # Los valores vacios se tratan como ausentes, igual que en format_record
+            column = pc.if_else(pc.equal(column, ""), pa.scalar(None, pa.string()), column)
+            arrow_type = arrow_types.get(bigquery_fields.get(field, ("STRING",))[0])
+            if arrow_type is not None:
+                try:
+                    column = pc.cast(column, arrow_type)
+                except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                    pass
+            columns[field] = column
+        # to_pylist arma los dicts en C; los None solo se quitan de los campos donde None no equivale
+        # al default (requeridos o con otro default), para que se apliquen igual que en format_record
+        rows = pa.RecordBatch.from_pydict(columns).to_pylist()
+        if drop_none_fields:
+            for row in rows:
+                for field in drop_none_fields:
+                    if row[field] is None:
+                        del row[field]
+        if short_rows:
+            rows.extend(_rows_to_dicts(split(short_rows), model, errors))
+            short_rows.clear()
+        yield _validate_rows(validate, rows, errors)
+    # Filas cortas de bloques sin ninguna fila completa
+    if short_rows:
+        yield _validate_rows(validate, _rows_to_dicts(split(short_rows), model, errors), errors)
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import os
+import json
+import hashlib
+import time
+import threading
+from typing import TYPE_CHECKING, Callable, Optional
+
+# cryptography se importa al construir el primer Fernet para no cargarlo en el import
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet, MultiFernet
+
+# Separador de keys cuando el secret contiene mas de una key (key ring)
+KEY_SEPARATOR = ","
+
+
+# Separa el secret en sus keys. La primera es la mas nueva y es la que se usa para encriptar.
+def split_keys(secret_value: str) -> list:
+    return [key.strip() for key in secret_value.split(KEY_SEPARATOR) if key.strip()]
+
+
+# Identificador de una key (se guarda en la metadata del blob, nunca la key en si)
+def key_id(key: str) -> str:
+    return hashlib.sha256(key.encode("UTF-8")).hexdigest()[:16]
+
+
+# Construye un Fernet (una key) o un MultiFernet (varias keys, la primera es la mas nueva)
+def build_fernet(secret_value: str) -> Fernet | MultiFernet:
+    from cryptography.fernet import Fernet, MultiFernet
+
+    keys = split_keys(secret_value)
+    if not keys:
+        raise ValueError("El secret no contiene ninguna key")
+    if len(keys) == 1:
+        return Fernet(keys[0])
+    return MultiFernet([Fernet(key) for key in keys])
+
+
+# Devuelve la instancia de Fernet para key, que puede ser la key en texto o un Fernet ya construido
+def as_fernet(key: str | Fernet | MultiFernet) -> Fernet | MultiFernet:
+    if isinstance(key, str):
+        return build_fernet(key)
+    return key
+
+
+# Cache en memoria (y opcionalmente en disco) del valor de un secret y su Fernet.
+# - Dentro del ttl se devuelve el valor cacheado sin llamar a fetch.
+# - Pasado refresh_ratio * ttl se refresca en un thread en background, sin bloquear.
+# - Vencido el ttl se refresca de forma sincronica.
+class KeyProvider:
+    def __init__(
+        self,
+        fetch: Callable[[], str],
+        ttl: float = 3600,
+        refresh_ratio: float = 0.8,
+        cache_path: Optional[str] = None,
+    ):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.refresh_ratio = refresh_ratio
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        self.refreshing = False
+        self.value = None
+        self.fernet = None
+        self.encryption_key = None
+        self.fetched_at = 0.0
+
+        if cache_path:
+            self._load_disk_cache()
+
+    def get_key(self) -> str:
+        age = time.time() - self.fetched_at
+        if self.value is None or age >= self.ttl:
+            with self.lock:
+                # Otro thread pudo haber refrescado mientras esperabamos el lock
+                if self.value is None or time.time() - self.fetched_at >= self.ttl:
+                    self._refresh()
+        elif age >= self.ttl * self.refresh_ratio:
+            self._refresh_in_background()
+        return self.value
+
+    def get_fernet(self) -> Fernet | MultiFernet:
+        self.get_key()
+        return self.fernet
+
+    # Fernet y id de la key con la que encripta, del mismo valor del secret. Usar este par para
+    # encriptar y escribir el key_id: con get_fernet + get_key_id un refresco entre ambas llamadas
+    # (rotacion del secret) dejaria el objeto marcado con el id de otra key.
+    def get_encryption_key(self) -> tuple[Fernet | MultiFernet, str]:
+        self.get_key()
+        return self.encryption_key
+
+    # Id de la key con la que se encripta (la primera del key ring)
+    def get_key_id(self) -> str:
+        return key_id(split_keys(self.get_key())[0])
+
+    # Key ring completo para desencriptar y rotar tokens
+    def get_multi_fernet(self) -> MultiFernet:
+        from cryptography.fernet import Fernet, MultiFernet
+
+        return MultiFernet([Fernet(key) for key in split_keys(self.get_key())])
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.value = None
+            self.fernet = None
+            self.encryption_key = None
+            self.fetched_at = 0.0
+
+    def _set_value(self, value: str, fetched_at: float) -> None:
+        fernet = build_fernet(value)
+        # El par (fernet, key_id) se reemplaza en una sola asignacion para que se lea consistente
+        self.encryption_key = (fernet, key_id(split_keys(value)[0]))
+        self.value, self.fernet, self.fetched_at = value, fernet, fetched_at
+
+    def _refresh(self) -> None:
+        self._set_value(self.fetch(), time.time())
+        if self.cache_path:
+            self._write_disk_cache()
+
+    def _refresh_in_background(self) -> None:
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self) -> None:
+        try:
+            with self.lock:
+                self._refresh()
+        except Exception as error:
+            # Se sigue usando el valor cacheado hasta que venza el ttl
+            print(f"Fallo el refresco del secret en background: {str(error)}")
+        finally:
+            self.refreshing = False
+
+    def _load_disk_cache(self) -> None:
+        try:
+            with open(self.cache_path, "r") as fcache:
+                cache = json.load(fcache)
+            if time.time() - cache["fetched_at"] < self.ttl:
+                self._set_value(cache["value"], cache["fetched_at"])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    # El archivo se crea con permisos 0600 y se reemplaza de forma atomica
+    def _write_disk_cache(self) -> None:
+        temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as fcache:
+                json.dump({"value": self.value, "fetched_at": self.fetched_at}, fcache)
+            os.replace(temp_path, self.cache_path)
+        except OSError as error:
+            print(f"No se pudo escribir el cache del secret: {str(error)}")
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import argparse
+from datetime import datetime
+
+from cryptography.fernet import Fernet, MultiFernet
+from google.cloud import storage
+from google.cloud import secretmanager
+
+from key_provider import KeyProvider, key_id, split_keys
+from framed_format import read_header, rotate_frames
+
+# Variables de entorno
+PROJECT_ID = os.environ.get("PROJECT_ID")
+BUCKET_ENCRIPTADOS = os.environ.get("BUCKET_ENCRIPTADOS")
+SECRET_KEY = os.environ.get("SECRET_KEY")
+
+# Constantes
+START_DATETIME = datetime.now()
+
+# Clientes de GCP
+storage_client = storage.Client()
+secret_client = secretmanager.SecretManagerServiceClient()
+
+
+# Obtiene el key ring (keys separadas por coma, la primera es la mas nueva)
+def get_secret_key() -> str:
+    name = f"projects/{PROJECT_ID}/secrets/{SECRET_KEY}/versions/latest"
+    response_secret = secret_client.access_secret_version(name=name)
+    return response_secret.payload.data.decode("UTF-8")
+
+key_provider = KeyProvider(get_secret_key)
+
+
+# Re-encripta el blob en el mismo objeto. if_generation_match evita pisar una version
+# escrita mientras se rotaba; la metadata se escribe junto con el contenido.
+def rotate_blob(blob: storage.Blob, f: MultiFernet, key_id: str) -> None:
+    metadata = dict(blob.metadata or {})
+    metadata["key_id"] = key_id
+    metadata["rotated_at"] = datetime.now().isoformat()
+
+    source = storage_client.bucket(blob.bucket.name).blob(blob.name, generation=blob.generation)
+    target = storage_client.bucket(blob.bucket.name).blob(blob.name)
+    target.metadata = metadata
+
+    with source.open(mode="rb") as finput:
+        header, is_framed = read_header(finput)
+        with target.open(mode="wb", if_generation_match=blob.generation) as foutput:
+            if is_framed:
+                foutput.write(header)
+                rotate_frames(finput, foutput, f)
+            else:
+                foutput.write(f.rotate(header + finput.read()))
+
+
+def load_cursor(cursor_file: str) -> dict:
+    if not os.path.exists(cursor_file):
+        return {}
+    with open(cursor_file, "r") as fcursor:
+        return json.load(fcursor)
+
+
+# Se escribe en un archivo temporal y se reemplaza para no perder el cursor si el proceso muere
+def save_cursor(cursor_file: str, cursor: dict) -> None:
+    temp_file = cursor_file + ".tmp"
+    with open(temp_file, "w") as fcursor:
+        json.dump(cursor, fcursor)
+    os.replace(temp_file, cursor_file)
+
+
+def main() -> int:
+
+    # 1 = Success | -1 = Failure
+
+    if not (PROJECT_ID and BUCKET_ENCRIPTADOS and SECRET_KEY):
+        print("Se deben setear las variables de entorno.")
+        return -1
+
+    parser = argparse.ArgumentParser(description="Re-encripta de forma incremental los blobs con una key vieja.")
+    parser.add_argument("--prefix", default="data/")
+    parser.add_argument("--cursor-file", default="reencriptar_cursor.json")
+    parser.add_argument("--max-objects", type=int, default=100, help="Maximo de objetos re-encriptados por ejecucion")
+    parser.add_argument("--max-mb-per-second", type=float, default=20.0)
+    args = parser.parse_args()
+
+    try:
+        # El key ring y el id de la key mas nueva salen del mismo valor del secret
+        keys = split_keys(key_provider.get_key())
+        f = MultiFernet([Fernet(key) for key in keys])
+        current_key_id = key_id(keys[0])
+    except Exception as error:
+        print(f"Fallo (obtencion del secret key): {str(error)}")
+        return -1
+
+    # El cursor es el ultimo blob procesado; una pasada completa lo reinicia
+    cursor = load_cursor(args.cursor_file)
+    if cursor.get("bucket") != BUCKET_ENCRIPTADOS or cursor.get("prefix") != args.prefix:
+        cursor = {"bucket": BUCKET_ENCRIPTADOS, "prefix": args.prefix, "last_name": ""}
+
+    rotated = 0
+    rotated_bytes = 0
+    start = time.perf_counter()
+    blobs = storage_client.list_blobs(BUCKET_ENCRIPTADOS, prefix=args.prefix, start_offset=cursor["last_name"] or None)
+    finished = True
+    for blob in blobs:
+        if blob.name == cursor["last_name"]:
+            continue
+        if rotated >= args.max_objects:
+            finished = False
+            break
+
+        if (blob.metadata or {}).get("key_id") != current_key_id:
+            try:
+                rotate_blob(blob, f, current_key_id)
+                rotated += 1
+                rotated_bytes += blob.size or 0
+                print(f"[ok] {blob.name}")
+            except Exception as error:
+                print(f"[error] {blob.name}: {str(error)}")
+
+            # Rate limit: se duerme lo necesario para no superar max_mb_per_second
+            expected = rotated_bytes / (args.max_mb_per_second * 1024 * 1024)
+            elapsed = time.perf_counter() - start
+            if expected > elapsed:
+                time.sleep(expected - elapsed)
+
+        cursor["last_name"] = blob.name
+        save_cursor(args.cursor_file, cursor)
+
+    if finished:
+        cursor["last_name"] = ""
+        save_cursor(args.cursor_file, cursor)
+
+    duration = round((datetime.now() - START_DATETIME).total_seconds())
+    status = "pasada completa" if finished else f"continua desde {cursor['last_name']}"
+    print(f"Re-encriptados {rotated} objetos ({rotated_bytes / (1024 * 1024):.2f} MB) en {duration}s, {status}")
+    return 1
+
+
+if __name__ == "__main__":
+    result = main()
+    if (result == -1):
+        print("Fallo el proceso")
+    else:
+        print("Proceso terminado con exito")
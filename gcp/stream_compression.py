@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import zlib
+import itertools
+from typing import BinaryIO, Iterator
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compresion al vuelo del contenido de los archivos framed (gcp/framed_format.py), compartida por
+# encriptar.py (CompressedStream) y desencriptar.py (decompress_blocks). El algoritmo se registra
+# en la metadata "compression" del blob: none | gzip | zstd.
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+DECOMPRESS_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+# Devuelve un compresor incremental (compress/flush) para el algoritmo indicado. En zstd, size (el
+# tamano sin comprimir, si se conoce) queda en el header del frame para validar la descompresion.
+def get_compressor(compression: str, size: int | None = None):
+    if compression == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("La compresion zstd requiere el paquete zstandard")
+        return zstandard.ZstdCompressor(level=3).compressobj(size=-1 if size is None else size)
+    raise ValueError(f"Compresion no soportada: {compression}")
+
+
+# Stream de lectura que comprime finput al vuelo, sin archivos intermedios.
+# La memoria queda acotada por chunk_size y el tamaño pedido en read.
+class CompressedStream:
+    def __init__(self, finput: BinaryIO, compression: str, chunk_size: int = DEFAULT_CHUNK_SIZE, size: int | None = None):
+        self.finput = finput
+        self.compressor = get_compressor(compression, size)
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.eof = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            block = self.finput.read(self.chunk_size)
+            if block:
+                self.bytes_in += len(block)
+                self.buffer += self.compressor.compress(block)
+            else:
+                self.buffer += self.compressor.flush()
+                self.eof = True
+
+        if size < 0 or size > len(self.buffer):
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.bytes_out += len(data)
+        return data
+
+
+# Stream de lectura sobre un iterador de bloques, para los decompresores que leen de un archivo
+class BlocksReader:
+    def __init__(self, blocks: Iterator[bytes]):
+        self.blocks = blocks
+        self.buffer = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.buffer) < size:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            self.buffer += block
+
+        if size < 0 or size > len(self.buffer):
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+# Descomprime al vuelo los bloques desencriptados (compression en la metadata del blob).
+# Cada bloque devuelto tiene como maximo DECOMPRESS_CHUNK_SIZE bytes.
+def decompress_blocks(blocks: Iterator[bytes], compression: str) -> Iterator[bytes]:
+    if compression == "gzip":
+        decompressor = zlib.decompressobj(31)
+        for block in blocks:
+            data = decompressor.decompress(block, DECOMPRESS_CHUNK_SIZE)
+            yield data
+            while decompressor.unconsumed_tail:
+                yield decompressor.decompress(decompressor.unconsumed_tail, DECOMPRESS_CHUNK_SIZE)
+        yield decompressor.flush()
+        if not decompressor.eof:
+            raise ValueError("Stream gzip incompleto")
+    elif compression == "zstd":
+        if zstandard is None:
+            raise ValueError("La descompresion zstd requiere el paquete zstandard")
+        yield from decompress_zstd_blocks(blocks)
+    else:
+        raise ValueError(f"Compresion no soportada: {compression}")
+
+
+# zstd con stream_reader: cada read devuelve como maximo DECOMPRESS_CHUNK_SIZE bytes, aunque un frame
+# muy comprimible se expanda a gigabytes. stream_reader no informa si el stream termino a mitad de un
+# frame, asi que se compara el total con el tamano del header (los archivos escritos sin size no se
+# pueden validar).
+def decompress_zstd_blocks(blocks: Iterator[bytes]) -> Iterator[bytes]:
+    blocks = iter(blocks)
+    first = next(blocks, b"")
+    try:
+        content_size = zstandard.get_frame_parameters(first).content_size
+    except zstandard.ZstdError as error:
+        raise ValueError(f"Stream zstd incompleto: {error}")
+
+    reader = zstandard.ZstdDecompressor().stream_reader(BlocksReader(itertools.chain([first], blocks)))
+    total = 0
+    while chunk := reader.read(DECOMPRESS_CHUNK_SIZE):
+        total += len(chunk)
+        yield chunk
+    if content_size != zstandard.CONTENTSIZE_UNKNOWN and total != content_size:
+        raise ValueError(f"Stream zstd incompleto: {total} de {content_size} bytes")
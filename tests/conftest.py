@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Los scripts se importan como en produccion: encriptar.py usa el paquete gcp desde la raiz y
+# los modulos de gcp/, gcp/ai/ y gcp/interface_file_bigquery/ se importan entre si por nombre
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "gcp"), os.path.join(ROOT, "gcp", "ai"), os.path.join(ROOT, "gcp", "interface_file_bigquery")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,194 @@
+import threading
+import types
+
+import pytest
+
+pytest.importorskip("apache_beam")
+pytest.importorskip("google.cloud.vision")
+
+from google.api_core import exceptions as api_exceptions
+from google.cloud import vision
+
+import cloudvision_dataflow_pipeline
+from cloudvision_dataflow_pipeline import ByteBudget, CloudVisionModelHandler
+from vision_cache import SqliteResultCache, cache_key
+
+
+# Cliente de Cloud Vision falso: responde a cada imagen con un label igual a su contenido y
+# registra el tamano de cada sub-request y la maxima cantidad de requests simultaneos
+class FakeVisionClient:
+    def __init__(self, failures: int = 0, delay: float = 0.0, budget: ByteBudget | None = None):
+        self.failures = failures
+        self.delay = delay
+        self.budget = budget
+        self.request_sizes = []
+        self.in_flight_bytes = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def batch_annotate_images(self, request):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.request_sizes.append(len(request.requests))
+            if self.budget is not None:
+                self.in_flight_bytes.append((self.budget.in_flight, sum(len(image_request.image.content) for image_request in request.requests)))
+            fail = self.failures > 0
+            self.failures -= int(fail)
+        try:
+            if fail:
+                raise api_exceptions.ResourceExhausted("cuota excedida")
+            if self.delay:
+                threading.Event().wait(self.delay)
+            return types.SimpleNamespace(
+                responses=[
+                    vision.AnnotateImageResponse(
+                        label_annotations=[vision.EntityAnnotation(description=image_request.image.content.decode())]
+                    )
+                    for image_request in request.requests
+                ]
+            )
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def labels(responses: list) -> list:
+    return [response.label_annotations[0].description for response in responses]
+
+
+def test_annotate_splits_requests_and_keeps_order():
+    handler = CloudVisionModelHandler(max_workers=3, max_images_per_request=4, max_request_bytes=1024)
+    client = FakeVisionClient()
+    images = [f"imagen-{index}".encode() for index in range(10)]
+
+    responses = handler.annotate(client, images)
+
+    assert labels(responses) == [image.decode() for image in images]
+    assert sorted(client.request_sizes) == [2, 4, 4]
+
+
+def test_annotate_sends_sub_requests_concurrently():
+    handler = CloudVisionModelHandler(max_workers=4, max_images_per_request=1)
+    client = FakeVisionClient(delay=0.05)
+
+    handler.annotate(client, [b"a", b"b", b"c", b"d"])
+
+    assert client.max_active > 1
+    assert client.max_active <= 4
+
+
+def test_annotate_retries_quota_errors():
+    handler = CloudVisionModelHandler(max_workers=1, initial_backoff=0.0)
+    client = FakeVisionClient(failures=2)
+
+    responses = handler.annotate(client, [b"a", b"b"])
+
+    assert labels(responses) == ["a", "b"]
+    assert client.request_sizes == [2, 2, 2]
+
+
+def test_annotate_gives_up_after_max_retries():
+    handler = CloudVisionModelHandler(max_workers=1, max_retries=1, initial_backoff=0.0)
+    client = FakeVisionClient(failures=5)
+
+    with pytest.raises(api_exceptions.ResourceExhausted):
+        handler.annotate(client, [b"a"])
+
+    assert len(client.request_sizes) == 2
+
+
+def test_run_inference_annotates_duplicated_content_once():
+    handler = CloudVisionModelHandler(max_workers=2)
+    client = FakeVisionClient()
+    batch = [("gs://bucket/a.jpg", b"a"), ("gs://bucket/copia.jpg", b"a"), ("gs://bucket/b.jpg", b"b")]
+
+    results = handler.run_inference(batch, client, None)
+
+    assert [path for path, _ in results] == [path for path, _ in batch]
+    assert labels([response for _, response in results]) == ["a", "a", "b"]
+    assert client.request_sizes == [2]
+
+
+def test_cache_key_uses_the_original_bytes_and_only_misses_are_preprocessed():
+    preprocessed = []
+
+    def preprocess(image: tuple) -> tuple:
+        preprocessed.append(image[0])
+        return image[0], image[1].upper()
+
+    handler = CloudVisionModelHandler(max_workers=1, preprocess=preprocess)
+    handler.cache = SqliteResultCache()
+    client = FakeVisionClient()
+    batch = [("gs://bucket/a.jpg", b"a"), ("gs://bucket/b.jpg", b"b")]
+
+    first = handler.run_inference(batch, client, None)
+    second = handler.run_inference(batch + [("gs://bucket/c.jpg", b"c")], client, None)
+
+    assert labels([response for _, response in first]) == ["A", "B"]
+    assert labels([response for _, response in second]) == ["A", "B", "C"]
+    assert preprocessed == ["gs://bucket/a.jpg", "gs://bucket/b.jpg", "gs://bucket/c.jpg"]
+    assert set(handler.cache.get_many([cache_key(b"a", handler.features_key)])) == {cache_key(b"a", handler.features_key)}
+
+
+@pytest.mark.parametrize("lazy_read", [False, True])
+def test_preprocess_runs_on_the_executor_threads(tmp_path, lazy_read):
+    threads = set()
+
+    def preprocess(image: tuple) -> tuple:
+        threads.add(threading.current_thread())
+        return image
+
+    batch = []
+    for index in range(4):
+        path = tmp_path / f"imagen-{index}.jpg"
+        path.write_bytes(f"imagen-{index}".encode())
+        batch.append((str(path), path.stat().st_size) if lazy_read else (str(path), path.read_bytes()))
+    # Con lazy_read y un unico thread de anotacion, preprocesar en el mismo pool se bloquearia
+    handler = CloudVisionModelHandler(max_workers=1, lazy_read=lazy_read, fetch_workers=2, preprocess=preprocess)
+
+    results = handler.run_inference(batch, FakeVisionClient(), None)
+
+    assert labels([response for _, response in results]) == [f"imagen-{index}" for index in range(4)]
+    assert threads and threading.main_thread() not in threads
+
+
+def test_handlers_without_load_model_share_the_process_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cloudvision_dataflow_pipeline, "_result_caches", {})
+    cache_kwargs = {"backend": "sqlite", "sqlite_path": str(tmp_path / "cache.db")}
+    batch = [("gs://bucket/a.jpg", b"a"), ("gs://bucket/b.jpg", b"b")]
+    # RunInference solo ejecuta load_model en una instancia del handler por proceso
+    loaded = CloudVisionModelHandler(max_workers=1, cache_kwargs=cache_kwargs)
+    loaded.cache = cloudvision_dataflow_pipeline.get_result_cache(cache_kwargs)
+    loaded.run_inference(batch, FakeVisionClient(), None)
+
+    handler = CloudVisionModelHandler(max_workers=1, cache_kwargs=cache_kwargs)
+    client = FakeVisionClient()
+    results = handler.run_inference(batch, client, None)
+
+    assert labels([response for _, response in results]) == ["a", "b"]
+    assert client.request_sizes == []
+    assert handler.cache is loaded.cache
+
+
+def test_lazy_read_keeps_the_images_in_the_budget_until_they_are_annotated(tmp_path, monkeypatch):
+    budget = ByteBudget(max_bytes=1024)
+    monkeypatch.setattr(cloudvision_dataflow_pipeline, "_byte_budget", budget)
+    references = []
+    for index in range(6):
+        path = tmp_path / f"imagen-{index}.jpg"
+        path.write_bytes(f"imagen-{index}".encode() * 10)
+        references.append((str(path), path.stat().st_size))
+
+    handler = CloudVisionModelHandler(max_workers=2, max_images_per_request=2, lazy_read=True, fetch_workers=2)
+    client = FakeVisionClient(budget=budget)
+
+    results = handler.run_inference(references, client, None)
+
+    assert [path for path, _ in results] == [path for path, _ in references]
+    assert labels([response for _, response in results]) == [f"imagen-{index}" * 10 for index in range(6)]
+    assert client.request_sizes == [2, 2, 2]
+    # Mientras se anota un sub-request, sus bytes siguen reservados
+    assert all(in_flight >= request_bytes for in_flight, request_bytes in client.in_flight_bytes)
+    assert budget.in_flight == 0
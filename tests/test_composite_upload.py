@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+
+from gcp.composite_upload import MAX_COMPOSE_SOURCES, ParallelCompositeWriter
+
+
+# Bucket de GCS en memoria con la parte de la API que usa el writer
+class FakeBucket:
+    def __init__(self, fail_uploads: set = frozenset()):
+        self.objects = {}
+        self.compose_sizes = []
+        self.fail_uploads = fail_uploads
+        self.lock = threading.Lock()
+
+    def blob(self, name: str) -> "FakeBlob":
+        return FakeBlob(self, name)
+
+
+class FakeBlob:
+    def __init__(self, bucket: FakeBucket, name: str):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+
+    def upload_from_string(self, data: bytes, content_type: str = None) -> None:
+        if self.name.rsplit("/", 1)[-1] in self.bucket.fail_uploads:
+            raise IOError(f"upload de {self.name} fallido")
+        with self.bucket.lock:
+            self.bucket.objects[self.name] = bytes(data)
+
+    def compose(self, sources: list) -> None:
+        if len(sources) > MAX_COMPOSE_SOURCES:
+            raise ValueError(f"compose con {len(sources)} objetos")
+        with self.bucket.lock:
+            self.bucket.compose_sizes.append(len(sources))
+            self.bucket.objects[self.name] = b"".join(self.bucket.objects[source.name] for source in sources)
+
+    def delete(self) -> None:
+        with self.bucket.lock:
+            del self.bucket.objects[self.name]
+
+
+def test_small_upload_uses_a_single_part():
+    bucket = FakeBucket()
+    with ParallelCompositeWriter(bucket.blob("data/file.encrypted"), part_size=1024, workers=2) as writer:
+        writer.write(b"hola")
+
+    assert bucket.objects == {"data/file.encrypted": b"hola"}
+
+
+def test_empty_upload_creates_an_empty_object():
+    bucket = FakeBucket()
+    with ParallelCompositeWriter(bucket.blob("data/empty.encrypted"), part_size=1024, workers=2):
+        pass
+
+    assert bucket.objects == {"data/empty.encrypted": b""}
+
+
+def test_multi_level_compose_keeps_order_and_removes_temporaries():
+    bucket = FakeBucket()
+    # 1100 partes > 32 * 32: se necesitan dos niveles de objetos intermedios
+    data = bytes(index % 251 for index in range(1100))
+    with ParallelCompositeWriter(bucket.blob("data/big.encrypted"), part_size=1, workers=8) as writer:
+        for start in range(0, len(data), 7):
+            writer.write(data[start:start + 7])
+
+    assert bucket.objects == {"data/big.encrypted": data}
+    assert max(bucket.compose_sizes) <= MAX_COMPOSE_SOURCES
+    assert len(bucket.compose_sizes) > 1 + 1100 // MAX_COMPOSE_SOURCES
+
+
+def test_failed_part_removes_uploaded_parts_and_skips_compose():
+    bucket = FakeBucket(fail_uploads={"00003"})
+    with pytest.raises(IOError):
+        with ParallelCompositeWriter(bucket.blob("data/file.encrypted"), part_size=4, workers=2) as writer:
+            writer.write(b"x" * 40)
+
+    assert bucket.objects == {}
+    assert bucket.compose_sizes == []
+
+
+def test_error_while_writing_aborts_the_upload():
+    bucket = FakeBucket()
+    with pytest.raises(RuntimeError):
+        with ParallelCompositeWriter(bucket.blob("data/file.encrypted"), part_size=4, workers=2) as writer:
+            writer.write(b"x" * 40)
+            raise RuntimeError("fallo la encriptacion")
+
+    assert bucket.objects == {}
+
+
+def test_concurrent_writers_to_the_same_name_do_not_share_parts():
+    bucket = FakeBucket()
+    first = ParallelCompositeWriter(bucket.blob("data/report.encrypted"), part_size=2, workers=2, temp_prefix="tmp/proceso")
+    second = ParallelCompositeWriter(bucket.blob("data/report.encrypted"), part_size=2, workers=2, temp_prefix="tmp/proceso")
+    first.write(b"aaaa")
+    second.write(b"bbbb")
+
+    assert not {part.name for part in first.parts} & {part.name for part in second.parts}
+    first.close()
+    assert bucket.objects["data/report.encrypted"] == b"aaaa"
+    second.close()
+    assert bucket.objects == {"data/report.encrypted": b"bbbb"}
@@ -0,0 +1,97 @@
+import datetime
+import io
+from typing import Optional
+
+import pytest
+
+from pydantic_base_model_bigquery import BigqueryBase
+import utils
+
+
+class LkpCsvModel(BigqueryBase):
+    __tablename__ = "lkp_csv"
+    __quotechar__ = '"'
+    codigo: int
+    nombre: str
+    descripcion: Optional[str] = None
+    importe: Optional[float] = None
+    fecha_carga: Optional[datetime.datetime] = None
+
+
+class LkpPlainModel(BigqueryBase):
+    __tablename__ = "lkp_plain"
+    __delimiter__ = "|"
+    __header__ = False
+    codigo: int
+    nombre: str
+    descripcion: Optional[str] = None
+
+
+CSV_FILE = (
+    "codigo,nombre,descripcion,importe,fecha_carga\n"
+    '1,"Perez, Juan","linea uno\nlinea dos",1.5,2024-01-01 10:00:00 UTC\n'
+    "\n"
+    '2,Ana,"con ""comillas""",,\n'
+    "3,Luis\n"
+)
+
+EXPECTED = [
+    {"codigo": 1, "nombre": "Perez, Juan", "descripcion": "linea uno\nlinea dos", "importe": 1.5, "fecha_carga": datetime.datetime(2024, 1, 1, 10)},
+    {"codigo": 2, "nombre": "Ana", "descripcion": 'con "comillas"', "importe": None, "fecha_carga": None},
+    {"codigo": 3, "nombre": "Luis", "descripcion": None, "importe": None, "fecha_carga": None},
+]
+
+
+def normalize(rows: list) -> list:
+    return sorted(({**row} for row in rows), key=lambda row: row["codigo"])
+
+
+def read_csv(text: str, model, **kwargs) -> list:
+    return [row for batch in utils.read_csv_batches(io.StringIO(text, newline=""), model, **kwargs) for row in batch]
+
+
+def read_arrow(text: str, model, **kwargs) -> list:
+    return [row for batch in utils.read_arrow_batches(io.BytesIO(text.encode()), model, **kwargs) for row in batch]
+
+
+@pytest.fixture(params=["csv", "arrow"])
+def read(request):
+    if request.param == "arrow":
+        pytest.importorskip("pyarrow")
+        return read_arrow
+    return read_csv
+
+
+def test_quoted_fields_blank_lines_and_short_rows(read):
+    assert normalize(read(CSV_FILE, LkpCsvModel)) == EXPECTED
+
+
+def test_engines_match_format_record(read):
+    lines = ["1|uno|primero", "2|dos", " 3 | tres |  "]
+
+    expected = [utils.format_record(line, "|", LkpPlainModel).model_dump() for line in lines]
+
+    assert normalize(read("\n".join(lines) + "\n", LkpPlainModel)) == normalize(expected)
+
+
+def test_invalid_row_fails_the_batch_without_errors(read):
+    with pytest.raises(Exception):
+        read("1|uno\nx|dos\n", LkpPlainModel)
+
+
+def test_invalid_rows_are_isolated_with_errors(read):
+    errors = []
+
+    rows = read("1|uno\nx|dos\n3|tres|descripcion|sobra\n4|cuatro\n", LkpPlainModel, errors=errors)
+
+    assert [row["codigo"] for row in normalize(rows)] == [1, 4]
+    assert len(errors) == 2
+
+
+def test_parse_csv_records_skips_blank_lines():
+    errors = []
+
+    rows = utils.parse_csv_records(["1|uno", "", "   ", "x|dos"], LkpPlainModel, errors=errors)
+
+    assert rows == [{"codigo": 1, "nombre": "uno", "descripcion": None}]
+    assert [values for values, _ in errors] == [{"codigo": "x", "nombre": "dos"}]
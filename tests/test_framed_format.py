@@ -0,0 +1,145 @@
+import io
+import os
+
+import pytest
+from cryptography.fernet import Fernet, MultiFernet
+
+from gcp.framed_format import FRAMED_PREFIX, iter_tokens, read_frames, read_header, rotate_frames, write_frames, write_token
+from gcp.stream_compression import CompressedStream, decompress_blocks
+
+FRAME_SIZE = 16
+
+
+def encrypt(data: bytes, f: Fernet, frame_size: int = FRAME_SIZE) -> bytes:
+    foutput = io.BytesIO()
+    write_frames(io.BytesIO(data), foutput, f, frame_size)
+    return foutput.getvalue()
+
+
+def decrypt(encrypted: bytes, f: Fernet | MultiFernet) -> bytes:
+    finput = io.BytesIO(encrypted)
+    _, is_framed = read_header(finput)
+    assert is_framed
+    return b"".join(read_frames(finput, f))
+
+
+# Devuelve los tokens del archivo encriptado, para armar streams alterados
+def tokens_of(encrypted: bytes) -> list:
+    finput = io.BytesIO(encrypted)
+    read_header(finput)
+    return list(iter_tokens(finput))
+
+
+def framed(tokens: list) -> bytes:
+    foutput = io.BytesIO()
+    foutput.write(FRAMED_PREFIX)
+    for token in tokens:
+        write_token(foutput, token)
+    return foutput.getvalue()
+
+
+@pytest.mark.parametrize("size", [0, 1, FRAME_SIZE - 1, FRAME_SIZE, FRAME_SIZE + 1, 3 * FRAME_SIZE])
+def test_round_trip_at_frame_size_boundaries(size):
+    f = Fernet(Fernet.generate_key())
+    data = os.urandom(size)
+
+    encrypted = encrypt(data, f)
+
+    assert decrypt(encrypted, f) == data
+    assert len(tokens_of(encrypted)) == max(1, -(-size // FRAME_SIZE))
+
+
+def test_legacy_token_is_not_framed():
+    f = Fernet(Fernet.generate_key())
+    finput = io.BytesIO(f.encrypt(b"legacy"))
+
+    header, is_framed = read_header(finput)
+
+    assert not is_framed
+    assert f.decrypt(header + finput.read()) == b"legacy"
+
+
+def test_unsupported_version_is_rejected():
+    with pytest.raises(ValueError, match="Version"):
+        read_header(io.BytesIO(FRAMED_PREFIX[:-1] + bytes([99])))
+
+
+def test_missing_last_frame_is_detected():
+    f = Fernet(Fernet.generate_key())
+    tokens = tokens_of(encrypt(b"x" * (3 * FRAME_SIZE), f))
+
+    with pytest.raises(ValueError, match="falta el ultimo frame"):
+        decrypt(framed(tokens[:-1]), f)
+
+
+def test_truncated_token_is_detected():
+    f = Fernet(Fernet.generate_key())
+    encrypted = encrypt(b"x" * (2 * FRAME_SIZE), f)
+
+    with pytest.raises(ValueError, match="truncado"):
+        decrypt(encrypted[:-10], f)
+
+
+def test_reordered_frames_are_detected():
+    f = Fernet(Fernet.generate_key())
+    tokens = tokens_of(encrypt(b"x" * (3 * FRAME_SIZE), f))
+
+    with pytest.raises(ValueError, match="fuera de orden"):
+        decrypt(framed([tokens[1], tokens[0], tokens[2]]), f)
+
+
+def test_rotated_file_decrypts_with_the_new_key_only():
+    old_key = Fernet(Fernet.generate_key())
+    new_key = Fernet(Fernet.generate_key())
+    data = os.urandom(2 * FRAME_SIZE + 5)
+    finput = io.BytesIO(encrypt(data, old_key))
+    read_header(finput)
+
+    foutput = io.BytesIO()
+    foutput.write(FRAMED_PREFIX)
+    frames = rotate_frames(finput, foutput, MultiFernet([new_key, old_key]))
+
+    assert frames == 3
+    assert decrypt(foutput.getvalue(), new_key) == data
+    with pytest.raises(Exception):
+        decrypt(foutput.getvalue(), old_key)
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compressed_round_trip(compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    f = Fernet(Fernet.generate_key())
+    data = b"".join(f"linea {index},valor {index % 7}\n".encode() for index in range(2000))
+
+    encrypted = io.BytesIO()
+    stream = CompressedStream(io.BytesIO(data), compression, chunk_size=1024)
+    write_frames(stream, encrypted, f, frame_size=512)
+    finput = io.BytesIO(encrypted.getvalue())
+    read_header(finput)
+
+    assert stream.bytes_in == len(data)
+    assert stream.bytes_out < len(data)
+    assert b"".join(decompress_blocks(read_frames(finput, f), compression)) == data
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_incomplete_compressed_stream_is_detected(compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    compressed = CompressedStream(io.BytesIO(os.urandom(4096)), compression, size=4096).read()
+
+    with pytest.raises(ValueError, match="incompleto"):
+        list(decompress_blocks(iter([compressed[:-8]]), compression))
+
+
+def test_zstd_output_is_bounded_per_block(monkeypatch):
+    pytest.importorskip("zstandard")
+    monkeypatch.setattr("gcp.stream_compression.DECOMPRESS_CHUNK_SIZE", 64 * 1024)
+    data = b"\0" * (4 * 1024 * 1024)
+    compressed = CompressedStream(io.BytesIO(data), "zstd", size=len(data)).read()
+
+    blocks = list(decompress_blocks(iter([compressed]), "zstd"))
+
+    assert b"".join(blocks) == data
+    assert max(len(block) for block in blocks) <= 64 * 1024
@@ -0,0 +1,99 @@
+import pytest
+
+from vision_requests import call_with_backoff, split_requests
+
+
+class QuotaError(Exception):
+    pass
+
+
+# Request que falla las primeras `failures` veces y despues devuelve "ok"
+class FlakyRequest:
+    def __init__(self, failures: int, error: type = QuotaError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error(f"fallo {self.calls}")
+        return "ok"
+
+
+def test_split_requests_respects_the_image_limit_and_keeps_order():
+    images = [bytes([index]) for index in range(10)]
+
+    sub_batches = split_requests(images, max_images=4, max_bytes=1024)
+
+    assert [len(sub_batch) for sub_batch in sub_batches] == [4, 4, 2]
+    assert [image for sub_batch in sub_batches for image in sub_batch] == images
+
+
+def test_split_requests_respects_the_byte_limit():
+    images = [b"a" * 40, b"b" * 40, b"c" * 30, b"d" * 90]
+
+    sub_batches = split_requests(images, max_images=16, max_bytes=100)
+
+    assert sub_batches == [[b"a" * 40, b"b" * 40], [b"c" * 30], [b"d" * 90]]
+
+
+def test_split_requests_sends_an_oversized_image_alone():
+    images = [b"a" * 10, b"b" * 500, b"c" * 10]
+
+    assert split_requests(images, max_images=16, max_bytes=100) == [[b"a" * 10], [b"b" * 500], [b"c" * 10]]
+
+
+def test_split_requests_with_a_size_function():
+    references = [("a.jpg", 60), ("b.jpg", 60), ("c.jpg", 10)]
+
+    sub_batches = split_requests(references, max_images=16, max_bytes=100, size=lambda reference: reference[1])
+
+    assert sub_batches == [[("a.jpg", 60)], [("b.jpg", 60), ("c.jpg", 10)]]
+
+
+def test_split_requests_of_an_empty_batch():
+    assert split_requests([], max_images=16, max_bytes=100) == []
+
+
+def test_call_with_backoff_retries_until_success_with_growing_backoff(monkeypatch):
+    monkeypatch.setattr("vision_requests.random.random", lambda: 0.5)
+    sleeps = []
+    request = FlakyRequest(failures=3)
+
+    result = call_with_backoff(request, (QuotaError,), max_retries=5, initial_backoff=1.0, sleep=sleeps.append)
+
+    assert result == "ok"
+    assert request.calls == 4
+    assert sleeps == [1.0, 2.0, 4.0]
+
+
+def test_call_with_backoff_jitter_stays_within_half_and_one_and_a_half_times():
+    sleeps = []
+
+    call_with_backoff(FlakyRequest(failures=4), (QuotaError,), max_retries=5, initial_backoff=2.0, sleep=sleeps.append)
+
+    for attempt, backoff in enumerate(sleeps):
+        assert 2.0 * 2 ** attempt * 0.5 <= backoff < 2.0 * 2 ** attempt * 1.5
+
+
+def test_call_with_backoff_raises_after_max_retries():
+    sleeps = []
+    request = FlakyRequest(failures=10)
+
+    with pytest.raises(QuotaError):
+        call_with_backoff(request, (QuotaError,), max_retries=2, initial_backoff=0.1, sleep=sleeps.append)
+
+    assert request.calls == 3
+    assert len(sleeps) == 2
+
+
+def test_call_with_backoff_does_not_retry_other_errors():
+    sleeps = []
+    request = FlakyRequest(failures=1, error=ValueError)
+
+    with pytest.raises(ValueError):
+        call_with_backoff(request, (QuotaError,), max_retries=5, sleep=sleeps.append)
+
+    assert request.calls == 1
+    assert sleeps == []
@@ -1,30 +1,305 @@
+import os
+import re
+import json
 import time
+import fnmatch
+import shlex
+import sqlite3
+import hashlib
+import argparse
+import threading
+import subprocess
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
 from watchdog.observers import Observer
-from watchdog.events import PatternMatchingEventHandler
 import watchdog.events as watch_events
 
 
-def on_created(event: watch_events.FileCreatedEvent):
-    print(f"The file {event.src_path} was created")
+# Agrupa los eventos por path y despacha cada archivo una unica vez, cuando su
+# size/mtime no cambio durante stable_ms. Los workers estan acotados y, si estan
+# todos ocupados, el despacho se bloquea (backpressure) mientras los eventos nuevos
+# se siguen agrupando en pending (un registro por path, la memoria no crece por evento).
+class CoalescingQueue:
+    def __init__(self, process: Callable[[str], None], stable_ms: int = 2000, max_workers: int = 4):
+        self.process = process
+        self.stable = stable_ms / 1000
+        self.pending = {}  # path -> [(size, mtime_ns), ultimo cambio]
+        self.in_flight = set()
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.slots = threading.BoundedSemaphore(max_workers)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
 
-def on_deleted(event: watch_events.FileDeletedEvent):
-    print(f"The file {event.src_path} was deleted")
+    def start(self) -> None:
+        self.thread.start()
 
-def on_modified(event: watch_events.FileModifiedEvent):
-    print(f"The file {event.src_path} was modified")
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.thread.join()
+        self.executor.shutdown(wait=True)
 
-def on_moved(event: watch_events.FileMovedEvent):
-    print(f"The file {event.src_path} was moved")
+    def touch(self, path: str) -> None:
+        with self.lock:
+            # Si se esta procesando, se vuelve a encolar cuando termine
+            if path in self.in_flight:
+                self.dirty.add(path)
+            else:
+                self.pending[path] = [None, time.monotonic()]
+
+    def discard(self, path: str) -> None:
+        with self.lock:
+            self.pending.pop(path, None)
+            self.dirty.discard(path)
+
+    def _run(self) -> None:
+        tick = min(self.stable / 2, 0.5)
+        while not self.stop_event.wait(tick):
+            for path in self._stable_paths():
+                # Backpressure: se espera un worker libre antes de despachar
+                while not self.slots.acquire(timeout=tick):
+                    if self.stop_event.is_set():
+                        return
+                self.executor.submit(self._process, path)
+
+    def _stable_paths(self) -> list:
+        with self.lock:
+            paths = list(self.pending)
+
+        # stat fuera del lock para no bloquear al observer
+        signatures = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                signatures[path] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                signatures[path] = None
+
+        now = time.monotonic()
+        ready = []
+        with self.lock:
+            for path, signature in signatures.items():
+                state = self.pending.get(path)
+                if state is None:
+                    continue
+                if signature is None:
+                    del self.pending[path]
+                elif signature != state[0]:
+                    state[0], state[1] = signature, now
+                elif now - state[1] >= self.stable:
+                    del self.pending[path]
+                    self.in_flight.add(path)
+                    ready.append(path)
+        return ready
+
+    def _process(self, path: str) -> None:
+        try:
+            self.process(path)
+        except Exception as error:
+            print(f"The file {path} failed: {error}")
+        finally:
+            self.slots.release()
+            with self.lock:
+                self.in_flight.discard(path)
+                if path in self.dirty:
+                    self.dirty.discard(path)
+                    self.pending[path] = [None, time.monotonic()]
+
+
+# Journal persistente (SQLite) de los archivos procesados. Permite reiniciar el watcher
+# sin perder los eventos ocurridos mientras estaba caido ni reprocesar archivos.
+class WorkJournal:
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, content_hash TEXT, state TEXT, updated_at REAL)"
+            )
+
+    def get(self, path: str) -> tuple | None:
+        with self.lock:
+            return self.connection.execute(
+                "SELECT size, mtime_ns, content_hash, state FROM files WHERE path = ?", (path,)
+            ).fetchone()
+
+    def set(self, path: str, size: int, mtime_ns: int, content_hash: str | None, state: str) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, content_hash, state, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, content_hash, state, time.time()),
+            )
+
+    # Compara el directorio contra el journal usando solo stat (sin leer los archivos).
+    # Devuelve los archivos nuevos, modificados o que no terminaron de procesarse,
+    # y elimina del journal los archivos que ya no existen.
+    def reconcile(self, root: str, recursive: bool = False) -> list:
+        with self.lock:
+            rows = {
+                path: (size, mtime_ns, state)
+                for path, size, mtime_ns, state in self.connection.execute("SELECT path, size, mtime_ns, state FROM files")
+            }
+
+        changed = []
+        seen = set()
+        for entry in scan_files(root, recursive):
+            stat = entry.stat()
+            seen.add(entry.path)
+            if rows.get(entry.path) != (stat.st_size, stat.st_mtime_ns, "done"):
+                changed.append(entry.path)
+
+        root_prefix = os.path.join(root, "")
+        removed = [(path,) for path in rows if path.startswith(root_prefix) and path not in seen]
+        with self.lock, self.connection:
+            self.connection.executemany("DELETE FROM files WHERE path = ?", removed)
+        return changed
+
+
+def scan_files(root: str, recursive: bool = False):
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                yield entry
+            elif recursive and entry.is_dir(follow_symlinks=False):
+                yield from scan_files(entry.path, recursive)
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    content_hash = hashlib.sha256()
+    with open(path, "rb") as finput:
+        while chunk := finput.read(chunk_size):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+# Envuelve process con el journal: si el contenido ya fue procesado (mismo hash) solo
+# se actualiza size/mtime; sino se registra processing -> done | failed.
+def journaled(process: Callable[[str], None], journal: WorkJournal) -> Callable[[str], None]:
+    def process_with_journal(path: str) -> None:
+        stat = os.stat(path)
+        content_hash = hash_file(path)
+        row = journal.get(path)
+        if row is not None and row[2] == content_hash and row[3] == "done":
+            journal.set(path, stat.st_size, stat.st_mtime_ns, content_hash, "done")
+            return
+
+        journal.set(path, stat.st_size, stat.st_mtime_ns, content_hash, "processing")
+        try:
+            process(path)
+        except Exception:
+            journal.set(path, stat.st_size, stat.st_mtime_ns, content_hash, "failed")
+            raise
+        journal.set(path, stat.st_size, stat.st_mtime_ns, content_hash, "done")
+    return process_with_journal
+
+
+# Ejecuta el comando para el archivo, p.ej. "python encriptar.py {path} watcher"
+def command_processor(command: str) -> Callable[[str], None]:
+    def process(path: str) -> None:
+        args = [arg.replace("{path}", path) for arg in shlex.split(command)]
+        subprocess.run(args, check=True)
+        print(f"The file {path} was processed")
+    return process
+
+def print_processor(path: str) -> None:
+    print(f"The file {path} is ready")
+
+
+# Enruta cada path a la queue de la primera ruta cuyo glob coincide. Todos los globs se
+# compilan en una unica regex con un grupo por ruta, asi cada evento se evalua una sola vez.
+class Router:
+    def __init__(self, routes: list):
+        self.queues = {}
+        groups = []
+        for index, route in enumerate(routes):
+            self.queues[f"r{index}"] = route["queue"]
+            patterns = "|".join(fnmatch.translate(pattern) for pattern in route["patterns"])
+            groups.append(f"(?P<r{index}>{patterns})")
+        self.regex = re.compile("|".join(groups), re.IGNORECASE)
+
+    def route(self, path: str) -> CoalescingQueue | None:
+        match = self.regex.match(path)
+        return self.queues[match.lastgroup] if match else None
+
+    def touch(self, path: str) -> None:
+        queue = self.route(path)
+        if queue is not None:
+            queue.touch(path)
+
+    def discard(self, path: str) -> None:
+        queue = self.route(path)
+        if queue is not None:
+            queue.discard(path)
+
+
+# Configuracion del watcher (JSON). Ejemplo:
+# {
+#     "stable_ms": 2000,
+#     "roots": [{"path": "./data", "recursive": true}],
+#     "routes": [
+#         {"name": "bigquery", "patterns": ["*.csv"], "command": "python load.py {path}", "workers": 4},
+#         {"name": "vision", "patterns": ["*.jpg", "*.jpeg"], "command": "python vision.py {path}", "workers": 2}
+#     ]
+# }
+def load_config(args: argparse.Namespace) -> dict:
+    if args.config:
+        with open(args.config, "r") as fconfig:
+            config = json.load(fconfig)
+    else:
+        config = {
+            "roots": [{"path": args.path, "recursive": args.recursive}],
+            "routes": [{"name": "default", "patterns": ["*"], "command": args.command, "workers": args.workers}],
+        }
+    config.setdefault("stable_ms", args.stable_ms)
+    return config
 
 
 def main():
-    
-    event_handler = PatternMatchingEventHandler(
-    patterns=["*"],
-    ignore_patterns=None,
-    ignore_directories=True,
-    case_sensitive=False,
-)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default=None, help="Configuracion JSON con roots y routes (reemplaza --path/--command/--workers)")
+    parser.add_argument("--path", default="./data")
+    parser.add_argument("--recursive", action="store_true")
+    parser.add_argument("--stable-ms", type=int, default=2000, help="Tiempo sin cambios de size/mtime para considerar el archivo completo")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--command", default=None, help='Comando por archivo, p.ej. "python encriptar.py {path} watcher"')
+    parser.add_argument("--journal", default="watch_journal.db", help='Journal SQLite de archivos procesados ("" para desactivarlo)')
+    args = parser.parse_args()
+
+    config = load_config(args)
+    journal = WorkJournal(args.journal) if args.journal else None
+
+    # Una queue por ruta: cada ruta tiene su propio limite de concurrencia
+    routes = []
+    for route in config["routes"]:
+        process = command_processor(route["command"]) if route.get("command") else print_processor
+        if journal is not None:
+            process = journaled(process, journal)
+        queue = CoalescingQueue(process, stable_ms=config["stable_ms"], max_workers=route.get("workers", 4))
+        routes.append({**route, "queue": queue})
+    router = Router(routes)
+
+    def on_created(event: watch_events.FileCreatedEvent):
+        if not event.is_directory:
+            router.touch(event.src_path)
+
+    def on_deleted(event: watch_events.FileDeletedEvent):
+        if not event.is_directory:
+            router.discard(event.src_path)
+
+    def on_modified(event: watch_events.FileModifiedEvent):
+        if not event.is_directory:
+            router.touch(event.src_path)
+
+    def on_moved(event: watch_events.FileMovedEvent):
+        if not event.is_directory:
+            router.discard(event.src_path)
+            router.touch(event.dest_path)
+
+    event_handler = watch_events.FileSystemEventHandler()
 
     event_handler.on_created = on_created
     event_handler.on_deleted = on_deleted
@@ -32,15 +307,28 @@ def main():
     event_handler.on_moved = on_moved
 
     observer = Observer()
-    observer.schedule(event_handler, path="./data", recursive=False)
-    
+    for root in config["roots"]:
+        observer.schedule(event_handler, path=root["path"], recursive=root.get("recursive", False))
+
+    # Se inicia el observer antes del rescan para no perder eventos entre ambos;
+    # los duplicados se agrupan en la queue y el journal evita reprocesar.
+    for route in routes:
+        route["queue"].start()
     observer.start()
+    if journal is not None:
+        for root in config["roots"]:
+            changed = journal.reconcile(root["path"], recursive=root.get("recursive", False))
+            print(f"{len(changed)} files pending since the last run in {root['path']}")
+            for path in changed:
+                router.touch(path)
     try:
         while True:
             time.sleep(10)
     except KeyboardInterrupt:
         observer.stop()
         observer.join()
-        
+        for route in routes:
+            route["queue"].stop()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()